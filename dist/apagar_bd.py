@@ -1,5 +1,6 @@
 import os
 import shutil
+import glob
 import time
 
 def excluir_banco_dados():
@@ -48,8 +49,15 @@ def excluir_banco_dados():
         # Pequena pausa para garantir que conexões sejam fechadas
         time.sleep(1)
         
-        # Excluir o arquivo
+        # Excluir o arquivo e os arquivos auxiliares do modo WAL
         os.remove(db_file)
+        for sufixo in ('-wal', '-shm'):
+            if os.path.exists(db_file + sufixo):
+                os.remove(db_file + sufixo)
+        
+        # Vendas pendentes da fila de gravação (um diário por terminal) não devem ir para o banco novo
+        for diario_vendas in glob.glob(os.path.join(db_dir, 'vendas_pendentes*')):
+            os.remove(diario_vendas)
         
         print("\n=== EXCLUSÃO CONCLUÍDA COM SUCESSO ===")
         print("O banco de dados foi excluído.")
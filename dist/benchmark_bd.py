@@ -0,0 +1,302 @@
+"""Benchmark da camada de dados do PDV
+
+Gera lojas sintéticas (produtos com variações, vendas com itens e sessões de
+caixa com seus movimentos) em bancos temporários e mede as funções públicas
+de database.py em cada escala. Os tempos são medidos com a instrumentação
+desligada; depois, uma chamada instrumentada de cada caso conta consultas e
+linhas lidas e captura o plano das consultas lentas.
+
+Uso:
+    python benchmark_bd.py                          # 10 mil, 100 mil e 1 milhão de vendas
+    python benchmark_bd.py --escalas 10000 --repeticoes 20
+    python benchmark_bd.py --json resultado.json    # salva para comparar depois
+
+O banco de produção não é tocado: cada escala usa um diretório temporário,
+removido ao final (a menos que --manter seja informado).
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import database
+
+TAMANHOS = ('P', 'M', 'G', 'GG')
+CORES = ('Preto', 'Branco', 'Azul')
+CATEGORIAS = ('Camisetas', 'Calças', 'Vestidos', 'Bermudas', 'Casacos', 'Acessórios')
+MARCAS = ('Aurora', 'Bravo', 'Cais', 'Duna', 'Estela', 'Fiorde', 'Guará', 'Horizonte')
+FORMAS_PAGAMENTO = ('Dinheiro', 'Cartão de Crédito', 'Cartão de Débito', 'PIX')
+
+# Dias de histórico das lojas geradas
+DIAS_HISTORICO = 365
+
+# Linhas inseridas por transação na geração
+TAMANHO_LOTE_GERACAO = 20000
+
+def usar_diretorio(diretorio):
+    """Aponta o database.py para um banco dentro do diretório informado"""
+    database.fechar_conexoes()
+    # get_app_data_dir() usa LOCALAPPDATA no Windows e ~ nos demais sistemas
+    os.environ['LOCALAPPDATA'] = diretorio
+    os.environ['HOME'] = diretorio
+    os.environ['USERPROFILE'] = diretorio
+    database.init_db()
+
+def gerar_produtos(cursor, quantidade_vendas, aleatorio):
+    """Cria modelos com variações de tamanho e cor; retorna [(id, codigo, preco)]"""
+    modelos = min(2000, max(100, quantidade_vendas // 200))
+    produtos = []
+    linhas = []
+    for modelo in range(1, modelos + 1):
+        categoria = aleatorio.choice(CATEGORIAS)
+        marca = aleatorio.choice(MARCAS)
+        preco = round(aleatorio.uniform(19.9, 399.9), 2)
+        for tamanho in TAMANHOS:
+            for cor in CORES:
+                produto_id = len(produtos) + 1
+                codigo = f"789{produto_id:010d}"
+                produtos.append((produto_id, codigo, preco))
+                linhas.append((
+                    produto_id, codigo, f"{categoria[:-1]} {marca} {modelo} {cor} {tamanho}",
+                    f"Modelo {modelo} da coleção {marca}", preco, 1000000, 5,
+                    categoria, marca, tamanho, cor
+                ))
+
+    cursor.executemany('''
+    INSERT INTO produtos
+        (id, codigo, nome, descricao, preco, quantidade, min_quantidade, categoria, marca, tamanho, cor)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', linhas)
+    return produtos
+
+def gerar_loja(quantidade_vendas, semente=42):
+    """Preenche o banco atual com uma loja sintética de quantidade_vendas vendas
+
+    Há uma sessão de caixa por dia, com abertura, um movimento por venda,
+    sangrias ocasionais e fechamento; a sessão do último dia fica aberta.
+    Os resumos diários e os totais das sessões são recalculados no final,
+    como faria a migração de um banco existente.
+    """
+    aleatorio = random.Random(semente)
+    hoje = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    inicio = hoje - timedelta(days=DIAS_HISTORICO - 1)
+    vendas_por_dia = quantidade_vendas / DIAS_HISTORICO
+
+    with database.conexao(imediata=True) as conn:
+        cursor = conn.cursor()
+        produtos = gerar_produtos(cursor, quantidade_vendas, aleatorio)
+
+    vendas, itens, movimentos = [], [], []
+
+    def gravar():
+        with database.conexao(imediata=True) as conn:
+            conn.executemany('''
+            INSERT INTO vendas (id, usuario_id, valor_total, forma_pagamento, codigo, desconto, data_venda)
+            VALUES (?, 1, ?, ?, ?, ?, ?)
+            ''', vendas)
+            conn.executemany('''
+            INSERT INTO itens_venda (venda_id, produto_id, quantidade, preco_unitario, subtotal)
+            VALUES (?, ?, ?, ?, ?)
+            ''', itens)
+            conn.executemany(database.SQL_INSERIR_MOVIMENTO_CAIXA, movimentos)
+        vendas.clear()
+        itens.clear()
+        movimentos.clear()
+
+    venda_id = 0
+    for numero_dia in range(DIAS_HISTORICO):
+        dia = inicio + timedelta(days=numero_dia)
+        ultimo_dia = numero_dia == DIAS_HISTORICO - 1
+        abertura = dia.replace(hour=8).strftime("%Y-%m-%d %H:%M:%S")
+        fechamento = dia.replace(hour=21).strftime("%Y-%m-%d %H:%M:%S")
+
+        with database.conexao() as conn:
+            sessao_id = conn.execute('''
+            INSERT INTO sessoes_caixa
+                (terminal, status, saldo_inicial, saldo_atual, operador_abertura, aberto_em, ultima_atualizacao)
+            VALUES (?, ?, 200, 200, 'admin', ?, ?)
+            ''', (database.TERMINAL_PADRAO, 'aberto' if ultimo_dia else 'fechado', abertura, abertura)).lastrowid
+        movimentos.append((abertura, 'abertura', 'Abertura de caixa', 200, sessao_id))
+
+        # Vendas distribuídas entre 08:00 e 20:59, respeitando o total pedido
+        fim_dia = round(vendas_por_dia * (numero_dia + 1))
+        quantidade_dia = fim_dia - venda_id
+        segundos = sorted(aleatorio.randrange(8 * 3600, 21 * 3600) for _ in range(quantidade_dia))
+        for segundo in segundos:
+            venda_id += 1
+            data_venda = (dia + timedelta(seconds=segundo)).strftime("%Y-%m-%d %H:%M:%S")
+            total = 0
+            for produto_id, _, preco in aleatorio.sample(produtos, aleatorio.choice((1, 1, 2, 2, 3, 4))):
+                quantidade = aleatorio.choice((1, 1, 1, 2, 3))
+                subtotal = round(preco * quantidade, 2)
+                total += subtotal
+                itens.append((venda_id, produto_id, quantidade, preco, subtotal))
+            desconto = round(total * 0.05, 2) if aleatorio.random() < 0.1 else 0
+            total = round(total - desconto, 2)
+            vendas.append((venda_id, total, aleatorio.choice(FORMAS_PAGAMENTO), f"V{venda_id:08d}", desconto, data_venda))
+            movimentos.append((data_venda, 'venda', f"Venda V{venda_id:08d}", total, sessao_id))
+            if aleatorio.random() < 0.01:
+                movimentos.append((data_venda, 'saida', 'Sangria', round(aleatorio.uniform(50, 300), 2), sessao_id))
+
+        if not ultimo_dia:
+            movimentos.append((fechamento, 'fechamento', 'Fechamento de caixa - Operador: admin', 0, sessao_id))
+        if len(vendas) >= TAMANHO_LOTE_GERACAO:
+            gravar()
+    gravar()
+
+    with database.conexao(imediata=True) as conn:
+        cursor = conn.cursor()
+        database._migracao_resumos_diarios(cursor)
+        database._recalcular_totais_caixa(cursor)
+        cursor.execute('''
+        UPDATE sessoes_caixa SET valor_final = saldo_atual, diferenca = 0,
+            operador_fechamento = 'admin', fechado_em = substr(aberto_em, 1, 10) || ' 21:00:00'
+        WHERE status = 'fechado'
+        ''')
+    database.invalidar_catalogo()
+    return produtos
+
+def milhar(numero):
+    return f"{numero:,}".replace(',', '.')
+
+def percentil(valores, fracao):
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(round(fracao * (len(ordenados) - 1))))]
+
+def cronometrar(funcao, repeticoes, preparar=None):
+    """Executa funcao() repeticoes vezes (após um aquecimento) e retorna os tempos em ms"""
+    tempos = []
+    for vez in range(repeticoes + 1):
+        if preparar:
+            preparar()
+        inicio = time.perf_counter()
+        funcao()
+        if vez:
+            tempos.append((time.perf_counter() - inicio) * 1000)
+    return tempos
+
+def contar(funcao, preparar=None):
+    """Executa funcao() com a instrumentação ligada e retorna as estatísticas da segunda chamada"""
+    # A primeira chamada reabre a conexão e recarrega o catálogo
+    for _ in range(2):
+        if preparar:
+            preparar()
+        database.zerar_estatisticas()
+        funcao()
+    return database.get_estatisticas()
+
+def executar_escala(quantidade_vendas, repeticoes, limite_lenta_ms, manter):
+    """Gera a loja, mede cada caso e retorna os resultados da escala"""
+    diretorio = tempfile.mkdtemp(prefix=f"pdv_benchmark_{quantidade_vendas}_")
+    try:
+        usar_diretorio(diretorio)
+        inicio = time.perf_counter()
+        produtos = gerar_loja(quantidade_vendas)
+        tempo_geracao = time.perf_counter() - inicio
+        print(f"\n=== {milhar(quantidade_vendas)} vendas, {milhar(len(produtos))} produtos "
+              f"(gerado em {tempo_geracao:.1f}s) ===")
+
+        aleatorio = random.Random(7)
+        hoje = datetime.now()
+        dia = lambda dias: (hoje - timedelta(days=dias)).strftime("%Y-%m-%d")
+
+        def venda():
+            itens = []
+            for _, codigo, preco in aleatorio.sample(produtos, 3):
+                itens.append({'codigo': codigo, 'quantidade': 1, 'preco': preco, 'subtotal': preco})
+            total = round(sum(item['subtotal'] for item in itens), 2)
+            database.registrar_venda({'itens': itens, 'total': total, 'forma_pagamento': 'PIX'})
+
+        def reabrir():
+            database.abrir_caixa(200, operador='benchmark')
+
+        casos = [
+            ("registrar_venda (3 itens)", venda, repeticoes * 10, None),
+            ("get_relatorio_vendas (hoje)", lambda: database.get_relatorio_vendas(dia(0), dia(0)), repeticoes, None),
+            ("get_relatorio_vendas (7 dias)", lambda: database.get_relatorio_vendas(dia(6), dia(0)), repeticoes, None),
+            ("get_relatorio_vendas (30 dias)", lambda: database.get_relatorio_vendas(dia(29), dia(0)), repeticoes, None),
+            ("get_produtos_mais_vendidos (30 dias)", lambda: database.get_produtos_mais_vendidos(dia(29), dia(0)), repeticoes, None),
+            ("get_produtos_mais_vendidos (tudo)", lambda: database.get_produtos_mais_vendidos(), repeticoes, None),
+            ("get_produtos_mais_vendidos (hora)",
+             lambda: database.get_produtos_mais_vendidos(dia(1) + " 10:00:00", dia(1) + " 11:00:00"), repeticoes, None),
+            ("get_caixa", lambda: database.get_caixa(), repeticoes * 10, None),
+            ("fechar_caixa", lambda: database.fechar_caixa("sistema"), repeticoes, reabrir),
+        ]
+        if quantidade_vendas <= 100000:
+            # O relatório sem período devolve o histórico inteiro em memória
+            casos.insert(4, ("get_relatorio_vendas (tudo)", lambda: database.get_relatorio_vendas(), max(1, repeticoes // 5), None))
+
+        # Tempos sem instrumentação, que tem custo por linha lida
+        tempos = [cronometrar(funcao, vezes, preparar) for _, funcao, vezes, preparar in casos]
+
+        # Uma chamada instrumentada por caso para contar consultas e capturar as lentas
+        database.ativar_instrumentacao(limite_lenta_ms)
+        resultados = []
+        for (nome, funcao, vezes, preparar), tempos_caso in zip(casos, tempos):
+            estatisticas = contar(funcao, preparar)
+            funcoes = estatisticas['funcoes'].values()
+            principal = max(funcoes, key=lambda f: f['tempo_total_ms']) if funcoes else {}
+            resultado = {
+                'caso': nome,
+                'repeticoes': vezes,
+                'mediana_ms': statistics.median(tempos_caso),
+                'p95_ms': percentil(tempos_caso, 0.95),
+                'minimo_ms': min(tempos_caso),
+                'consultas': principal.get('consultas', 0),
+                'linhas': principal.get('linhas', 0),
+                'consultas_lentas': estatisticas['consultas_lentas'],
+            }
+            resultados.append(resultado)
+            print(f"{nome:<40} mediana {resultado['mediana_ms']:>9.2f} ms  p95 {resultado['p95_ms']:>9.2f} ms  "
+                  f"{resultado['consultas']:>3} consultas  {resultado['linhas']:>8} linhas")
+
+        # Deixar o caixa aberto como estava
+        reabrir()
+
+        lentas = [lenta for resultado in resultados for lenta in resultado['consultas_lentas']]
+        if lentas:
+            print(f"\nConsultas acima de {limite_lenta_ms} ms:")
+            vistas = set()
+            for lenta in sorted(lentas, key=lambda l: l['tempo_ms'], reverse=True):
+                if lenta['sql'] in vistas:
+                    continue
+                vistas.add(lenta['sql'])
+                print(f"- {lenta['tempo_ms']:.1f} ms em {lenta['funcao']}: {lenta['sql'][:120]}")
+                if lenta['plano']:
+                    print("    " + lenta['plano'].replace("\n", "\n    "))
+
+        return {'vendas': quantidade_vendas, 'produtos': len(produtos), 'geracao_s': tempo_geracao, 'casos': resultados}
+    finally:
+        database.desativar_instrumentacao()
+        database.fechar_conexoes()
+        if manter:
+            print(f"\nBanco mantido em: {diretorio}")
+        else:
+            shutil.rmtree(diretorio, ignore_errors=True)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark da camada de dados do PDV")
+    parser.add_argument('--escalas', type=int, nargs='+', default=[10000, 100000, 1000000],
+                        help="quantidades de vendas das lojas geradas")
+    parser.add_argument('--repeticoes', type=int, default=10, help="repetições de cada consulta")
+    parser.add_argument('--lenta-ms', type=float, default=50, help="limite para registrar consultas lentas")
+    parser.add_argument('--json', help="arquivo para salvar os resultados")
+    parser.add_argument('--manter', action='store_true', help="não apagar os bancos gerados")
+    args = parser.parse_args()
+
+    print(f"SQLite {database.sqlite3.sqlite_version} / Python {sys.version.split()[0]}")
+    resultados = [executar_escala(escala, args.repeticoes, args.lenta_ms, args.manter) for escala in args.escalas]
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(resultados, f, ensure_ascii=False, indent=2)
+        print(f"\nResultados salvos em: {args.json}")
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,48 @@
 import os
 import json
+import csv
 import sqlite3
 from datetime import datetime
 import hashlib
 import pytz  # Adicionar para suporte a fusos horários
 import platform
+import sys
+import threading
+import atexit
+import collections
+import functools
+import time
+import tempfile
+import re
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+
+# Trava de arquivo usada para que só um processo use o diário da fila de cada terminal
+if os.name == 'nt':
+    import msvcrt
+else:
+    import fcntl
+
+try:
+    # Opcional: sem o Pillow as miniaturas não são geradas e a grade usa a imagem original
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+# Pragmas aplicados a cada conexão aberta pelo gerenciador.
+# WAL permite que relatórios leiam enquanto uma venda está sendo gravada;
+# synchronous=NORMAL é seguro em WAL e evita um fsync por commit.
+PRAGMAS_CONEXAO = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA cache_size = -16000",      # ~16 MB de cache de páginas
+    "PRAGMA mmap_size = 268435456",    # 256 MB mapeados em memória
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA busy_timeout = 5000",
+)
+
+# Quantidade de comandos preparados mantidos em cache por conexão
+CACHE_COMANDOS_PREPARADOS = 256
 
 def get_app_data_dir():
     """Retorna o diretório de dados da aplicação baseado no sistema operacional"""
@@ -21,11 +59,167 @@ def get_database_path():
     """Retorna o caminho completo do arquivo do banco de dados"""
     return os.path.join(get_app_data_dir(), 'database.db')
 
+class ConexaoPersistente(sqlite3.Connection):
+    """Conexão SQLite reutilizada entre chamadas pela mesma thread
+
+    O método close() não encerra a conexão: apenas descarta alterações
+    pendentes (como aconteceria num fechamento real) e a devolve ao pool.
+    """
+
+    def close(self):
+        # Dentro de um bloco conexao() quem decide commit/rollback é o bloco
+        if _gerenciador.profundidade() == 0 and self.in_transaction:
+            self.rollback()
+
+    def fechar(self):
+        """Encerra de fato a conexão com o banco"""
+        sqlite3.Connection.close(self)
+
+
+class GerenciadorConexoes:
+    """Mantém uma conexão persistente por thread com o banco de dados"""
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._conexoes = {}  # ident da thread -> conexão
+        self._geracao = 0  # conexões de gerações anteriores são reabertas pela própria thread
+
+    def _abrir(self):
+        conn = sqlite3.connect(
+            get_database_path(),
+            factory=ConexaoInstrumentada if _instrumentacao.ativa else ConexaoPersistente,
+            cached_statements=CACHE_COMANDOS_PREPARADOS,
+            check_same_thread=False,  # fechar_todas() pode rodar em outra thread
+        )
+        conn.row_factory = sqlite3.Row  # Para acessar colunas pelo nome
+        for pragma in PRAGMAS_CONEXAO:
+            conn.execute(pragma)
+        return conn
+
+    def obter(self, renovar=False):
+        """Retorna a conexão da thread atual, abrindo-a se necessário
+        
+        Com renovar, uma conexão aberta antes de nova_geracao() é trocada
+        por uma nova, desde que não haja transação em andamento nela.
+        """
+        conn = getattr(self._local, "conn", None)
+        if (conn is not None and renovar and self._local.geracao != self._geracao
+                and self.profundidade() == 0 and not conn.in_transaction):
+            with self._lock:
+                self._conexoes.pop(threading.get_ident(), None)
+            try:
+                conn.fechar()
+            except sqlite3.Error:
+                pass
+            conn = None
+        if conn is None:
+            geracao = self._geracao
+            conn = self._abrir()
+            self._local.conn = conn
+            self._local.geracao = geracao
+            self._local.profundidade = 0
+            with self._lock:
+                self._descartar_threads_encerradas()
+                self._conexoes[threading.get_ident()] = conn
+        return conn
+
+    def profundidade(self):
+        """Quantidade de blocos conexao() abertos na thread atual"""
+        return getattr(self._local, "profundidade", 0)
+
+    def apos_commit(self, funcao):
+        """Agenda funcao() para depois do commit da transação da thread atual"""
+        if self.profundidade() == 0:
+            funcao()
+        else:
+            self._local.apos_commit = getattr(self._local, "apos_commit", [])
+            self._local.apos_commit.append(funcao)
+
+    def pendentes_apos_commit(self):
+        """Retorna e descarta as funções agendadas para depois do commit"""
+        funcoes = getattr(self._local, "apos_commit", [])
+        self._local.apos_commit = []
+        return funcoes
+
+    def entrar(self):
+        self._local.profundidade = self.profundidade() + 1
+
+    def sair(self):
+        self._local.profundidade = self.profundidade() - 1
+        return self._local.profundidade
+
+    def _descartar_threads_encerradas(self):
+        ativas = {thread.ident for thread in threading.enumerate()}
+        for ident in [i for i in self._conexoes if i not in ativas]:
+            try:
+                self._conexoes.pop(ident).fechar()
+            except sqlite3.Error:
+                pass
+
+    def nova_geracao(self):
+        """Faz cada thread reabrir a própria conexão na próxima entrada em conexao()
+        
+        Ao contrário de fechar_todas(), não interrompe conexões em uso.
+        """
+        with self._lock:
+            self._geracao += 1
+
+    def fechar_todas(self):
+        """Fecha todas as conexões abertas (ex.: ao encerrar o aplicativo)"""
+        with self._lock:
+            for conn in self._conexoes.values():
+                try:
+                    conn.fechar()
+                except sqlite3.Error:
+                    pass
+            self._conexoes.clear()
+        # As threads recriam a conexão na próxima chamada
+        self._local = threading.local()
+
+
+_gerenciador = GerenciadorConexoes()
+atexit.register(_gerenciador.fechar_todas)
+
+@contextmanager
+def conexao(imediata=False):
+    """Fornece a conexão persistente da thread atual
+
+    Ao sair do bloco mais externo é feito commit; se ocorrer uma exceção,
+    rollback. Blocos aninhados participam da mesma transação.
+
+    Args:
+        imediata: Inicia a transação com BEGIN IMMEDIATE, reservando a
+            escrita logo no início (útil para leituras seguidas de escrita)
+    """
+    conn = _gerenciador.obter(renovar=True)
+    if imediata and _gerenciador.profundidade() == 0 and not conn.in_transaction:
+        conn.execute("BEGIN IMMEDIATE")
+    _gerenciador.entrar()
+    try:
+        yield conn
+    except BaseException:
+        if _gerenciador.sair() == 0:
+            _gerenciador.pendentes_apos_commit()
+            conn.rollback()
+        raise
+    else:
+        if _gerenciador.sair() == 0:
+            conn.commit()
+            for funcao in _gerenciador.pendentes_apos_commit():
+                funcao()
+
+def fechar_conexoes():
+    """Fecha todas as conexões persistentes com o banco de dados"""
+    global _esquema
+    _gerenciador.fechar_todas()
+    # O próximo acesso pode ser a outro arquivo de banco
+    _esquema = None
+    _catalogo.invalidar()
+
 def get_connection():
-    """Retorna uma conexão com o banco de dados SQLite"""
-    conn = sqlite3.connect(get_database_path())
-    conn.row_factory = sqlite3.Row  # Para acessar colunas pelo nome
-    return conn
+    """Retorna a conexão persistente da thread atual com o banco de dados SQLite"""
+    return _gerenciador.obter()
 
 def get_datetime_now():
     """Retorna a data e hora atual no formato de Brasília"""
@@ -33,14 +227,317 @@ def get_datetime_now():
     tz_brasil = pytz.timezone('America/Sao_Paulo')
     return datetime.now(tz_brasil).strftime("%Y-%m-%d %H:%M:%S")
 
-def create_database():
-    """Cria o banco de dados e suas tabelas se não existirem"""
-    db_path = get_database_path()
+# Instrumentação opcional da camada de dados (desligada por padrão).
+# Quando ativa, as conexões passam a usar CursorInstrumentado, que mede tempo
+# e linhas lidas de cada comando; as funções públicas marcadas com
+# @_instrumentada acumulam latência e quantidade de consultas por chamada.
+
+# Quantidade de consultas lentas mantidas no registro
+MAXIMO_CONSULTAS_LENTAS = 100
+
+# Primeiras palavras dos comandos que aceitam EXPLAIN QUERY PLAN
+COMANDOS_COM_PLANO = ('SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+
+class Instrumentacao:
+    """Acumula as estatísticas de funções e consultas enquanto ativa"""
+
+    def __init__(self):
+        self.ativa = False
+        self.limite_lenta = 0.05  # segundos
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._sql_normalizado = {}
+        self.zerar()
+
+    def zerar(self):
+        with self._lock:
+            self._funcoes = {}   # nome -> [chamadas, tempo_total, tempo_maximo, consultas, linhas]
+            self._consultas = {} # sql -> [execucoes, tempo_total, tempo_maximo, linhas]
+            self._lentas = collections.deque(maxlen=MAXIMO_CONSULTAS_LENTAS)
+
+    def _pilha(self):
+        pilha = getattr(self._local, "pilha", None)
+        if pilha is None:
+            pilha = self._local.pilha = []
+        return pilha
+
+    def medir_funcao(self, nome, funcao, args, kwargs):
+        """Executa a função contando tempo e as consultas feitas durante a chamada"""
+        pilha = self._pilha()
+        contadores = [nome, 0, 0]  # nome, consultas, linhas
+        pilha.append(contadores)
+        inicio = time.perf_counter()
+        try:
+            return funcao(*args, **kwargs)
+        finally:
+            tempo = time.perf_counter() - inicio
+            pilha.pop()
+            with self._lock:
+                estatistica = self._funcoes.setdefault(nome, [0, 0.0, 0.0, 0, 0])
+                estatistica[0] += 1
+                estatistica[1] += tempo
+                estatistica[2] = max(estatistica[2], tempo)
+                estatistica[3] += contadores[1]
+                estatistica[4] += contadores[2]
+
+    def _normalizar(self, sql):
+        normalizado = self._sql_normalizado.get(sql)
+        if normalizado is None:
+            normalizado = self._sql_normalizado[sql] = " ".join(sql.split())
+        return normalizado
+
+    def registrar_consulta(self, sql, tempo, linhas, nova):
+        """Soma tempo e linhas ao comando; nova=False para leituras de um comando já contado"""
+        sql = self._normalizar(sql)
+        for contadores in self._pilha():
+            contadores[1] += nova
+            contadores[2] += linhas
+        with self._lock:
+            estatistica = self._consultas.setdefault(sql, [0, 0.0, 0.0, 0])
+            estatistica[0] += nova
+            estatistica[1] += tempo
+            estatistica[2] = max(estatistica[2], tempo)
+            estatistica[3] += linhas
+
+    def registrar_lenta(self, conn, sql, parametros, tempo, linhas):
+        """Guarda a consulta lenta com o plano de execução; retorna o registro para atualização"""
+        pilha = self._pilha()
+        registro = {
+            'sql': self._normalizar(sql),
+            'parametros': parametros if isinstance(parametros, (tuple, dict)) else tuple(parametros),
+            'tempo_ms': tempo * 1000,
+            'linhas': linhas,
+            'funcao': pilha[0][0] if pilha else None,
+            'data': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            'plano': _plano_consulta(conn, sql, parametros),
+        }
+        with self._lock:
+            self._lentas.append(registro)
+        return registro
+
+    def retrato(self):
+        """Cópia das estatísticas acumuladas (tempos em milissegundos)"""
+        with self._lock:
+            funcoes = {
+                nome: {
+                    'chamadas': chamadas,
+                    'tempo_total_ms': total * 1000,
+                    'tempo_medio_ms': total * 1000 / chamadas,
+                    'tempo_maximo_ms': maximo * 1000,
+                    'consultas': consultas,
+                    'linhas': linhas,
+                }
+                for nome, (chamadas, total, maximo, consultas, linhas) in self._funcoes.items()
+            }
+            consultas = [
+                {
+                    'sql': sql,
+                    'execucoes': execucoes,
+                    'tempo_total_ms': total * 1000,
+                    'tempo_medio_ms': total * 1000 / execucoes if execucoes else 0,
+                    'tempo_maximo_ms': maximo * 1000,
+                    'linhas': linhas,
+                }
+                for sql, (execucoes, total, maximo, linhas) in self._consultas.items()
+            ]
+            lentas = [dict(registro) for registro in self._lentas]
+        
+        consultas.sort(key=lambda consulta: consulta['tempo_total_ms'], reverse=True)
+        return {
+            'ativa': self.ativa,
+            'limite_lenta_ms': self.limite_lenta * 1000,
+            'funcoes': funcoes,
+            'consultas': consultas,
+            'consultas_lentas': lentas,
+        }
+
+
+_instrumentacao = Instrumentacao()
+
+def _plano_consulta(conn, sql, parametros):
+    """Retorna o EXPLAIN QUERY PLAN do comando, indentado como no shell do sqlite"""
+    palavras = sql.split(None, 1)
+    if not palavras or palavras[0].upper() not in COMANDOS_COM_PLANO:
+        return None
+    try:
+        # Cursor comum: o próprio EXPLAIN não entra nas estatísticas
+        linhas = conn.cursor(sqlite3.Cursor).execute("EXPLAIN QUERY PLAN " + sql, parametros).fetchall()
+    except sqlite3.Error:
+        return None
+    
+    niveis = {0: -1}
+    plano = []
+    for id_no, pai, _, detalhe in linhas:
+        niveis[id_no] = niveis.get(pai, -1) + 1
+        plano.append("  " * niveis[id_no] + detalhe)
+    return "\n".join(plano)
+
+class CursorInstrumentado(sqlite3.Cursor):
+    """Cursor que registra tempo, execuções e linhas lidas de cada comando"""
+
+    _sql = None
+    _parametros = ()
+    _tempo = 0.0
+    _linhas = 0
+    _lenta = None
+
+    def _concluir(self, inicio, linhas, nova):
+        tempo = time.perf_counter() - inicio
+        self._tempo += tempo
+        self._linhas += linhas
+        _instrumentacao.registrar_consulta(self._sql, tempo, linhas, nova)
+        
+        if self._lenta is not None:
+            self._lenta['tempo_ms'] = self._tempo * 1000
+            self._lenta['linhas'] = self._linhas
+        elif self._tempo >= _instrumentacao.limite_lenta:
+            self._lenta = _instrumentacao.registrar_lenta(
+                self.connection, self._sql, self._parametros, self._tempo, self._linhas
+            )
+
+    def _iniciar(self, sql, parametros):
+        self._sql = sql
+        self._parametros = parametros
+        self._tempo = 0.0
+        self._linhas = 0
+        self._lenta = None
+
+    def execute(self, sql, parametros=()):
+        self._iniciar(sql, parametros)
+        inicio = time.perf_counter()
+        try:
+            return super().execute(sql, parametros)
+        finally:
+            self._concluir(inicio, 0, 1)
+
+    def executemany(self, sql, lista_parametros):
+        if not isinstance(lista_parametros, (list, tuple)):
+            lista_parametros = list(lista_parametros)
+        # O plano de uma consulta lenta é obtido com o primeiro conjunto de parâmetros
+        self._iniciar(sql, lista_parametros[0] if lista_parametros else ())
+        inicio = time.perf_counter()
+        try:
+            return super().executemany(sql, lista_parametros)
+        finally:
+            self._concluir(inicio, 0, 1)
+
+    def fetchone(self):
+        inicio = time.perf_counter()
+        linha = super().fetchone()
+        if self._sql is not None:
+            self._concluir(inicio, linha is not None, 0)
+        return linha
+
+    def fetchmany(self, size=None):
+        inicio = time.perf_counter()
+        linhas = super().fetchmany(self.arraysize if size is None else size)
+        if self._sql is not None:
+            self._concluir(inicio, len(linhas), 0)
+        return linhas
+
+    def fetchall(self):
+        inicio = time.perf_counter()
+        linhas = super().fetchall()
+        if self._sql is not None:
+            self._concluir(inicio, len(linhas), 0)
+        return linhas
+
+    def __next__(self):
+        inicio = time.perf_counter()
+        try:
+            linha = super().__next__()
+        except StopIteration:
+            if self._sql is not None:
+                self._concluir(inicio, 0, 0)
+            raise
+        if self._sql is not None:
+            self._concluir(inicio, 1, 0)
+        return linha
+
+
+class ConexaoInstrumentada(ConexaoPersistente):
+    """Conexão persistente cujos comandos passam pelo CursorInstrumentado"""
+
+    def cursor(self, factory=CursorInstrumentado):
+        return super().cursor(factory)
+
+    def execute(self, sql, parametros=()):
+        return self.cursor().execute(sql, parametros)
+
+    def executemany(self, sql, lista_parametros):
+        return self.cursor().executemany(sql, lista_parametros)
+
+    def commit(self):
+        inicio = time.perf_counter()
+        try:
+            super().commit()
+        finally:
+            _instrumentacao.registrar_consulta("COMMIT", time.perf_counter() - inicio, 0, 1)
+
+
+def _instrumentada(funcao):
+    """Decorador: mede a função quando a instrumentação estiver ativa"""
+    nome = funcao.__name__
+    
+    @functools.wraps(funcao)
+    def medida(*args, **kwargs):
+        if not _instrumentacao.ativa:
+            return funcao(*args, **kwargs)
+        return _instrumentacao.medir_funcao(nome, funcao, args, kwargs)
+    
+    return medida
+
+def ativar_instrumentacao(limite_lenta_ms=50):
+    """Passa a medir funções e consultas; consultas acima do limite são registradas com o plano
     
-    # Criar conexão com o banco de dados
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
+    Cada thread troca a própria conexão por uma com o cursor instrumentado
+    ao iniciar a próxima transação; as que estiverem em uso não são
+    interrompidas.
+    """
+    _instrumentacao.limite_lenta = limite_lenta_ms / 1000
+    if not _instrumentacao.ativa:
+        _instrumentacao.ativa = True
+        _gerenciador.nova_geracao()
+
+def desativar_instrumentacao():
+    """Volta às conexões sem medição; as estatísticas acumuladas são mantidas"""
+    if _instrumentacao.ativa:
+        _instrumentacao.ativa = False
+        _gerenciador.nova_geracao()
+
+def zerar_estatisticas():
+    """Descarta as estatísticas acumuladas pela instrumentação"""
+    _instrumentacao.zerar()
+
+def get_estatisticas():
+    """Retorna um retrato das estatísticas da instrumentação
     
+    Returns:
+        dict: 'funcoes' (por nome: chamadas, tempos, consultas e linhas),
+        'consultas' (por comando, do maior tempo total para o menor) e
+        'consultas_lentas' (com parâmetros e plano de execução)
+    """
+    return _instrumentacao.retrato()
+
+# Migrações do esquema, aplicadas em ordem uma única vez por banco.
+# Cada migração recebe um cursor dentro da transação de aplicar_migracoes();
+# para alterar o esquema, acrescente uma nova entrada ao final de MIGRACOES.
+
+def _colunas_tabela(cursor, tabela):
+    """Retorna o conjunto de colunas de uma tabela"""
+    cursor.execute(f"PRAGMA table_info({tabela})")
+    return {coluna[1] for coluna in cursor.fetchall()}
+
+def _adicionar_colunas(cursor, tabela, colunas):
+    """Adiciona à tabela as colunas que ainda não existem"""
+    existentes = _colunas_tabela(cursor, tabela)
+    for coluna, tipo in colunas.items():
+        if coluna not in existentes:
+            cursor.execute(f"ALTER TABLE {tabela} ADD COLUMN {coluna} {tipo}")
+            print(f"Coluna '{coluna}' adicionada à tabela {tabela} com sucesso!")
+
+def _migracao_esquema_inicial(cursor):
+    """Cria as tabelas do sistema e o usuário administrador"""
     # Criar tabela de usuários
     cursor.execute('''
     CREATE TABLE IF NOT EXISTS usuarios (
@@ -52,7 +549,7 @@ def create_database():
         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
     )
     ''')
-    
+
     # Criar tabela de produtos
     cursor.execute('''
     CREATE TABLE IF NOT EXISTS produtos (
@@ -72,7 +569,7 @@ def create_database():
         updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
     )
     ''')
-    
+
     # Criar tabela de vendas
     cursor.execute('''
     CREATE TABLE IF NOT EXISTS vendas (
@@ -84,7 +581,7 @@ def create_database():
         FOREIGN KEY (usuario_id) REFERENCES usuarios (id)
     )
     ''')
-    
+
     # Criar tabela de itens da venda
     cursor.execute('''
     CREATE TABLE IF NOT EXISTS itens_venda (
@@ -98,7 +595,7 @@ def create_database():
         FOREIGN KEY (produto_id) REFERENCES produtos (id)
     )
     ''')
-    
+
     # Criar tabela de movimentações de estoque
     cursor.execute('''
     CREATE TABLE IF NOT EXISTS movimentacoes_estoque (
@@ -111,7 +608,7 @@ def create_database():
         FOREIGN KEY (produto_id) REFERENCES produtos (id)
     )
     ''')
-    
+
     # Criar tabela de caixa
     cursor.execute('''
     CREATE TABLE IF NOT EXISTS caixa (
@@ -121,7 +618,7 @@ def create_database():
         ultima_atualizacao TIMESTAMP DEFAULT CURRENT_TIMESTAMP
     )
     ''')
-    
+
     # Criar tabela de movimentos do caixa
     cursor.execute('''
     CREATE TABLE IF NOT EXISTS movimentos_caixa (
@@ -132,7 +629,7 @@ def create_database():
         valor REAL NOT NULL
     )
     ''')
-    
+
     # Criar usuário admin se não existir
     cursor.execute('SELECT id FROM usuarios WHERE usuario = ?', ('admin',))
     if not cursor.fetchone():
@@ -140,98 +637,397 @@ def create_database():
         INSERT INTO usuarios (nome, usuario, senha, tipo)
         VALUES (?, ?, ?, ?)
         ''', ('Administrador', 'admin', 'admin', 'admin'))
+
+def _migracao_colunas_produtos(cursor):
+    """Garante as colunas de variação de produto em bancos antigos"""
+    _adicionar_colunas(cursor, 'produtos', {
+        'marca': 'TEXT',
+        'cor': 'TEXT',
+        'tamanho': 'TEXT'
+    })
+
+def _migracao_colunas_vendas(cursor):
+    """Garante as colunas usadas no registro de vendas em bancos antigos"""
+    colunas_antigas = _colunas_tabela(cursor, 'vendas')
+    _adicionar_colunas(cursor, 'vendas', {
+        'usuario_id': 'INTEGER',
+        'valor_total': 'REAL',
+        'forma_pagamento': 'TEXT',
+        'desconto': 'REAL',
+        'data_venda': 'TIMESTAMP',
+        'codigo': 'TEXT'
+    })
+    
+    # Bancos muito antigos guardavam a data na coluna 'data'
+    if 'data' in colunas_antigas and 'data_venda' not in colunas_antigas:
+        cursor.execute("UPDATE vendas SET data_venda = data WHERE data_venda IS NULL")
+
+def _migracao_indices(cursor):
+    """Cria os índices usados pelos relatórios por período e pelas junções de itens"""
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_vendas_data_venda ON vendas (data_venda)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_itens_venda_venda ON itens_venda (venda_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_itens_venda_produto ON itens_venda (produto_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_movimentos_caixa_data ON movimentos_caixa (data)")
+
+def _migracao_resumos_diarios(cursor):
+    """Cria os resumos diários de vendas e de produtos e os preenche com o histórico
+    
+    Vendas antigas sem data_venda ficam no dia '' e só entram nas consultas
+    sem período.
+    """
+    # Vendas por dia e forma de pagamento
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS resumo_vendas_dia (
+        dia TEXT NOT NULL,
+        forma_pagamento TEXT NOT NULL,
+        quantidade_vendas INTEGER NOT NULL DEFAULT 0,
+        valor_total REAL NOT NULL DEFAULT 0,
+        desconto_total REAL NOT NULL DEFAULT 0,
+        PRIMARY KEY (dia, forma_pagamento)
+    ) WITHOUT ROWID
+    ''')
+    
+    # Unidades e faturamento por produto por dia
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS resumo_produtos_dia (
+        dia TEXT NOT NULL,
+        produto_id INTEGER NOT NULL,
+        quantidade INTEGER NOT NULL DEFAULT 0,
+        valor_total REAL NOT NULL DEFAULT 0,
+        PRIMARY KEY (dia, produto_id)
+    ) WITHOUT ROWID
+    ''')
+    
+    cursor.execute("DELETE FROM resumo_vendas_dia")
+    cursor.execute('''
+    INSERT INTO resumo_vendas_dia
+        (dia, forma_pagamento, quantidade_vendas, valor_total, desconto_total)
+    SELECT 
+        COALESCE(substr(data_venda, 1, 10), ''),
+        COALESCE(forma_pagamento, ''),
+        COUNT(*),
+        COALESCE(SUM(valor_total), 0),
+        COALESCE(SUM(desconto), 0)
+    FROM vendas
+    GROUP BY 1, 2
+    ''')
     
-    # Commit e fechar conexão
-    conn.commit()
-    conn.close()
+    cursor.execute("DELETE FROM resumo_produtos_dia")
+    cursor.execute('''
+    INSERT INTO resumo_produtos_dia
+        (dia, produto_id, quantidade, valor_total)
+    SELECT 
+        COALESCE(substr(v.data_venda, 1, 10), ''),
+        iv.produto_id,
+        SUM(iv.quantidade),
+        SUM(iv.subtotal)
+    FROM itens_venda iv
+    JOIN vendas v ON v.id = iv.venda_id
+    GROUP BY 1, 2
+    ''')
 
-def check_and_fix_database():
-    """Verifica e corrige problemas na estrutura do banco de dados"""
-    conn = sqlite3.connect(get_database_path())
-    cursor = conn.cursor()
+def _migracao_busca_produtos(cursor):
+    """Cria o índice FTS5 de busca por nome, descrição, marca e categoria
     
+    O índice é mantido por gatilhos sobre a tabela produtos. Se o SQLite
+    não tiver suporte a FTS5, a migração não faz nada e buscar_produtos()
+    usa LIKE.
+    """
     try:
-        # Verificar se a tabela produtos existe
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='produtos'")
-        if cursor.fetchone():
-            # Verificar se a coluna marca existe
-            cursor.execute("PRAGMA table_info(produtos)")
-            colunas = [coluna[1] for coluna in cursor.fetchall()]
+        cursor.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS produtos_busca USING fts5(
+            nome, descricao, marca, categoria,
+            content = 'produtos',
+            content_rowid = 'id',
+            tokenize = 'unicode61 remove_diacritics 1',
+            prefix = '2 3'
+        )
+        ''')
+    except sqlite3.OperationalError as e:
+        print(f"Busca textual indisponível (FTS5): {str(e)}")
+        return
+    
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS produtos_busca_insert AFTER INSERT ON produtos BEGIN
+        INSERT INTO produtos_busca (rowid, nome, descricao, marca, categoria)
+        VALUES (new.id, new.nome, new.descricao, new.marca, new.categoria);
+    END
+    ''')
+    
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS produtos_busca_delete AFTER DELETE ON produtos BEGIN
+        INSERT INTO produtos_busca (produtos_busca, rowid, nome, descricao, marca, categoria)
+        VALUES ('delete', old.id, old.nome, old.descricao, old.marca, old.categoria);
+    END
+    ''')
+    
+    # Só dispara quando muda um campo indexado (não a cada baixa de estoque)
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS produtos_busca_update
+    AFTER UPDATE OF id, nome, descricao, marca, categoria ON produtos BEGIN
+        INSERT INTO produtos_busca (produtos_busca, rowid, nome, descricao, marca, categoria)
+        VALUES ('delete', old.id, old.nome, old.descricao, old.marca, old.categoria);
+        INSERT INTO produtos_busca (rowid, nome, descricao, marca, categoria)
+        VALUES (new.id, new.nome, new.descricao, new.marca, new.categoria);
+    END
+    ''')
+    
+    cursor.execute("INSERT INTO produtos_busca (produtos_busca) VALUES ('rebuild')")
+
+def _migracao_sessoes_caixa(cursor):
+    """Cria as sessões de caixa e converte o estado do caixa antigo
+    
+    Os movimentos existentes são mantidos. Se o caixa antigo estava aberto,
+    uma sessão aberta é criada e recebe os movimentos desde a abertura.
+    """
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS sessoes_caixa (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        terminal TEXT NOT NULL,
+        status TEXT NOT NULL,
+        saldo_inicial REAL NOT NULL DEFAULT 0,
+        total_entradas REAL NOT NULL DEFAULT 0,
+        total_saidas REAL NOT NULL DEFAULT 0,
+        saldo_atual REAL NOT NULL DEFAULT 0,
+        valor_final REAL,
+        diferenca REAL,
+        operador_abertura TEXT,
+        operador_fechamento TEXT,
+        aberto_em TIMESTAMP,
+        fechado_em TIMESTAMP,
+        ultima_atualizacao TIMESTAMP
+    )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_sessoes_caixa_terminal ON sessoes_caixa (terminal, id)")
+    # No máximo uma sessão aberta por terminal
+    cursor.execute('''
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_sessoes_caixa_aberta
+    ON sessoes_caixa (terminal) WHERE status = 'aberto'
+    ''')
+    
+    # Totais de cada tipo de movimento por sessão
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS totais_sessao_caixa (
+        sessao_id INTEGER NOT NULL,
+        tipo TEXT NOT NULL,
+        quantidade INTEGER NOT NULL DEFAULT 0,
+        total REAL NOT NULL DEFAULT 0,
+        PRIMARY KEY (sessao_id, tipo)
+    ) WITHOUT ROWID
+    ''')
+    
+    _adicionar_colunas(cursor, 'movimentos_caixa', {'sessao_id': 'INTEGER'})
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_movimentos_caixa_sessao ON movimentos_caixa (sessao_id, id)")
+    
+    # Abertura e fechamento passam a ter tipo próprio (antes eram reconhecidos pela descrição)
+    cursor.execute('''
+    UPDATE movimentos_caixa SET tipo = 'abertura'
+    WHERE lower(descricao) LIKE 'abertura de caixa%'
+    ''')
+    
+    # Descobrir se o caixa antigo estava aberto
+    cursor.execute('''
+    SELECT id, tipo, data FROM movimentos_caixa
+    WHERE tipo IN ('abertura', 'fechamento')
+    ORDER BY data DESC, id DESC LIMIT 1
+    ''')
+    controle = cursor.fetchone()
+    cursor.execute("SELECT * FROM caixa ORDER BY id DESC LIMIT 1")
+    caixa = cursor.fetchone()
+    
+    aberto = (controle is not None and controle[1] == 'abertura') or \
+        (controle is None and caixa is not None and caixa[2] > 0)
+    if not aberto:
+        return
+    
+    saldo_inicial = caixa[1] if caixa is not None else 0
+    aberto_em = controle[2] if controle is not None else caixa[3]
+    cursor.execute('''
+    INSERT INTO sessoes_caixa 
+        (terminal, status, saldo_inicial, saldo_atual, aberto_em, ultima_atualizacao)
+    VALUES
+        (?, 'aberto', ?, ?, ?, ?)
+    ''', (TERMINAL_PADRAO, saldo_inicial, saldo_inicial, aberto_em, aberto_em))
+    sessao_id = cursor.lastrowid
+    
+    cursor.execute('''
+    UPDATE movimentos_caixa SET sessao_id = ?
+    WHERE sessao_id IS NULL AND id >= ?
+    ''', (sessao_id, controle[0] if controle is not None else 0))
+    
+    _recalcular_totais_caixa(cursor)
+
+def _migracao_fila_vendas(cursor):
+    """Cria o registro da última venda do diário da fila gravada no banco
+    
+    Gravado na mesma transação das vendas, indica quais entradas do diário
+    ainda precisam ser aplicadas depois de uma queda do aplicativo.
+    """
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS fila_vendas (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        ultima_sequencia INTEGER NOT NULL DEFAULT 0
+    )
+    ''')
+    cursor.execute("INSERT OR IGNORE INTO fila_vendas (id, ultima_sequencia) VALUES (1, 0)")
+
+def _migracao_fila_vendas_por_terminal(cursor):
+    """Passa a guardar a última venda gravada do diário de cada terminal
+    
+    Cada terminal tem o próprio diário, numerado a partir de 1; um controle
+    único fazia as vendas de um terminal parecerem já gravadas pelo número
+    alcançado em outro. O controle existente fica com o terminal padrão,
+    dono do diário anterior.
+    """
+    cursor.execute("ALTER TABLE fila_vendas RENAME TO fila_vendas_antiga")
+    cursor.execute('''
+    CREATE TABLE fila_vendas (
+        terminal TEXT PRIMARY KEY,
+        ultima_sequencia INTEGER NOT NULL DEFAULT 0
+    )
+    ''')
+    cursor.execute(
+        "INSERT INTO fila_vendas (terminal, ultima_sequencia) SELECT ?, ultima_sequencia FROM fila_vendas_antiga",
+        (TERMINAL_PADRAO,)
+    )
+    cursor.execute("DROP TABLE fila_vendas_antiga")
+
+# Alterações de produtos guardadas para os catálogos de outros processos;
+# um catálogo que ficar mais atrás do que isso é recarregado inteiro
+ALTERACOES_PRODUTOS_MANTIDAS = 10000
+
+def _migracao_alteracoes_produtos(cursor):
+    """Cria o registro de produtos alterados, mantido por gatilhos
+    
+    Permite que o catálogo em memória de cada processo (ex.: outro
+    terminal usando o mesmo banco) descubra quais produtos reler. Só as
+    últimas ALTERACOES_PRODUTOS_MANTIDAS alterações são mantidas.
+    """
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS alteracoes_produtos (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        produto_id INTEGER NOT NULL
+    )
+    ''')
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS alteracoes_produtos_insert AFTER INSERT ON produtos BEGIN
+        INSERT INTO alteracoes_produtos (produto_id) VALUES (new.id);
+    END
+    ''')
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS alteracoes_produtos_update AFTER UPDATE ON produtos BEGIN
+        INSERT INTO alteracoes_produtos (produto_id) VALUES (new.id);
+        INSERT INTO alteracoes_produtos (produto_id) SELECT old.id WHERE old.id <> new.id;
+    END
+    ''')
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS alteracoes_produtos_delete AFTER DELETE ON produtos BEGIN
+        INSERT INTO alteracoes_produtos (produto_id) VALUES (old.id);
+    END
+    ''')
+    cursor.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS alteracoes_produtos_limite AFTER INSERT ON alteracoes_produtos BEGIN
+        DELETE FROM alteracoes_produtos WHERE seq <= new.seq - {ALTERACOES_PRODUTOS_MANTIDAS};
+    END
+    ''')
+
+MIGRACOES = [
+    (1, "Esquema inicial", _migracao_esquema_inicial),
+    (2, "Colunas marca, cor e tamanho em produtos", _migracao_colunas_produtos),
+    (3, "Colunas desconto, código e data_venda em vendas", _migracao_colunas_vendas),
+    (4, "Índices de vendas, itens e movimentos do caixa", _migracao_indices),
+    (5, "Resumos diários de vendas e de produtos", _migracao_resumos_diarios),
+    (6, "Índice de busca textual de produtos", _migracao_busca_produtos),
+    (7, "Sessões de caixa com totais acumulados", _migracao_sessoes_caixa),
+    (8, "Controle do diário da fila de vendas", _migracao_fila_vendas),
+    (9, "Registro de alterações de produtos", _migracao_alteracoes_produtos),
+    (10, "Controle da fila de vendas por terminal", _migracao_fila_vendas_por_terminal),
+]
+
+# Descritor do esquema, calculado após as migrações e reutilizado pelas consultas
+_esquema = None
+_lock_esquema = threading.Lock()
+
+def _ler_esquema(cursor):
+    """Lê a versão do esquema e as colunas de cada tabela"""
+    cursor.execute("SELECT COALESCE(MAX(versao), 0) FROM schema_version")
+    versao = cursor.fetchone()[0]
+    
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+    tabelas = [linha[0] for linha in cursor.fetchall()]
+    
+    return {
+        "versao": versao,
+        "tabelas": {tabela: frozenset(_colunas_tabela(cursor, tabela)) for tabela in tabelas}
+    }
+
+def aplicar_migracoes():
+    """Aplica as migrações pendentes e atualiza o descritor do esquema
+    
+    As migrações já registradas na tabela schema_version não são executadas
+    novamente. Todas as pendentes rodam numa única transação.
+    
+    Returns:
+        dict: Descritor do esquema com a versão e as colunas de cada tabela
+    """
+    global _esquema
+    
+    with _lock_esquema:
+        with conexao(imediata=True) as conn:
+            cursor = conn.cursor()
             
-            # Se a coluna marca não existir, adicionar
-            if "marca" not in colunas:
-                try:
-                    cursor.execute("ALTER TABLE produtos ADD COLUMN marca TEXT")
-                    print("Coluna 'marca' adicionada com sucesso!")
-                    conn.commit()
-                except Exception as e:
-                    print(f"Erro ao adicionar coluna 'marca': {str(e)}")
+            cursor.execute('''
+            CREATE TABLE IF NOT EXISTS schema_version (
+                versao INTEGER PRIMARY KEY,
+                descricao TEXT NOT NULL,
+                aplicada_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            ''')
             
-            # Se a coluna cor não existir, adicionar
-            if "cor" not in colunas:
-                try:
-                    cursor.execute("ALTER TABLE produtos ADD COLUMN cor TEXT")
-                    print("Coluna 'cor' adicionada com sucesso!")
-                    conn.commit()
-                except Exception as e:
-                    print(f"Erro ao adicionar coluna 'cor': {str(e)}")
-                    
-            # Se a coluna tamanho não existir, adicionar
-            if "tamanho" not in colunas:
-                try:
-                    cursor.execute("ALTER TABLE produtos ADD COLUMN tamanho TEXT")
-                    print("Coluna 'tamanho' adicionada com sucesso!")
-                    conn.commit()
-                except Exception as e:
-                    print(f"Erro ao adicionar coluna 'tamanho': {str(e)}")
-        
-        # Verificar se a tabela vendas existe
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='vendas'")
-        if cursor.fetchone():
-            # Verificar colunas necessárias na tabela vendas
-            cursor.execute("PRAGMA table_info(vendas)")
-            colunas_vendas = [coluna[1] for coluna in cursor.fetchall()]
+            cursor.execute("SELECT COALESCE(MAX(versao), 0) FROM schema_version")
+            versao_atual = cursor.fetchone()[0]
             
-            # Verificar colunas necessárias para o processo de vendas
-            colunas_necessarias = {
-                'usuario_id': 'INTEGER',
-                'valor_total': 'REAL',
-                'forma_pagamento': 'TEXT',
-                'desconto': 'REAL',
-                'data_venda': 'TIMESTAMP',
-                'codigo': 'TEXT'
-            }
+            for versao, descricao, migracao in MIGRACOES:
+                if versao <= versao_atual:
+                    continue
+                
+                migracao(cursor)
+                cursor.execute(
+                    "INSERT INTO schema_version (versao, descricao) VALUES (?, ?)",
+                    (versao, descricao)
+                )
+                print(f"Migração {versao} aplicada: {descricao}")
             
-            # Adicionar colunas que faltam
-            for coluna, tipo in colunas_necessarias.items():
-                if coluna not in colunas_vendas:
-                    try:
-                        cursor.execute(f"ALTER TABLE vendas ADD COLUMN {coluna} {tipo}")
-                        print(f"Coluna '{coluna}' adicionada à tabela vendas com sucesso!")
-                        conn.commit()
-                    except Exception as e:
-                        print(f"Erro ao adicionar coluna '{coluna}' à tabela vendas: {str(e)}")
-                    
+            _esquema = _ler_esquema(cursor)
+    
+    return _esquema
+
+def get_esquema():
+    """Retorna o descritor do esquema, aplicando as migrações na primeira chamada"""
+    esquema = _esquema
+    if esquema is None:
+        esquema = aplicar_migracoes()
+    return esquema
+
+def create_database():
+    """Cria o banco de dados e suas tabelas se não existirem"""
+    aplicar_migracoes()
+
+def check_and_fix_database():
+    """Verifica e corrige problemas na estrutura do banco de dados"""
+    try:
+        aplicar_migracoes()
         print("Verificação da estrutura do banco de dados concluída.")
-        
     except Exception as e:
         print(f"Erro ao verificar/corrigir banco de dados: {str(e)}")
-    finally:
-        conn.close()
 
 def init_db():
-    """Inicializa o banco de dados"""
-    # Se o banco de dados não existir, cria-o
-    if not os.path.exists(get_database_path()):
-        create_database()
-    
-    # Verificar e corrigir a estrutura do banco de dados
-    check_and_fix_database()
+    """Inicializa o banco de dados, aplicando as migrações pendentes"""
+    aplicar_migracoes()
 
 def get_db_connection():
     """Retorna uma conexão com o banco de dados"""
-    db_path = get_database_path()
-    return sqlite3.connect(db_path)
+    return get_connection()
 
 def get_db_cursor():
     """Retorna um cursor para executar comandos no banco de dados"""
@@ -239,43 +1035,26 @@ def get_db_cursor():
     return conn.cursor()
 
 def close_db_connection(conn):
-    """Fecha a conexão com o banco de dados"""
+    """Devolve a conexão ao pool (a conexão persistente não é encerrada)"""
     if conn:
         conn.close()
 
 def execute_query(query, params=None):
     """Executa uma query SQL e retorna o resultado"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    try:
+    with conexao() as conn:
+        cursor = conn.cursor()
+        
         if params:
             cursor.execute(query, params)
         else:
             cursor.execute(query)
         
-        result = cursor.fetchall()
-        conn.commit()
-        return result
-    except Exception as e:
-        conn.rollback()
-        raise e
-    finally:
-        conn.close()
+        return cursor.fetchall()
 
 def execute_many(query, params_list):
     """Executa várias queries SQL com diferentes parâmetros"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    try:
-        cursor.executemany(query, params_list)
-        conn.commit()
-    except Exception as e:
-        conn.rollback()
-        raise e
-    finally:
-        conn.close()
+    with conexao() as conn:
+        conn.executemany(query, params_list)
 
 def get_user_by_username(username):
     """Retorna um usuário pelo nome de usuário"""
@@ -336,10 +1115,9 @@ def delete_product(product_id):
 
 def update_stock(product_id, quantity, movement_type, reference=None):
     """Atualiza o estoque de um produto"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    try:
+    with conexao() as conn:
+        cursor = conn.cursor()
+        
         # Atualizar estoque do produto
         cursor.execute('''
         UPDATE products 
@@ -352,20 +1130,12 @@ def update_stock(product_id, quantity, movement_type, reference=None):
         INSERT INTO stock_movements (product_id, quantity, movement_type, reference)
         VALUES (?, ?, ?, ?)
         ''', (product_id, quantity, movement_type, reference))
-        
-        conn.commit()
-    except Exception as e:
-        conn.rollback()
-        raise e
-    finally:
-        conn.close()
 
 def create_sale(user_id, items, payment_method):
     """Cria uma nova venda"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    try:
+    with conexao() as conn:
+        cursor = conn.cursor()
+        
         # Calcular valor total
         total_amount = sum(item['quantity'] * item['unit_price'] for item in items)
         
@@ -391,13 +1161,7 @@ def create_sale(user_id, items, payment_method):
             WHERE id = ?
             ''', (item['quantity'], item['product_id']))
         
-        conn.commit()
         return sale_id
-    except Exception as e:
-        conn.rollback()
-        raise e
-    finally:
-        conn.close()
 
 def get_sales_by_date_range(start_date, end_date):
     """Retorna vendas em um intervalo de datas"""
@@ -504,209 +1268,892 @@ def hash_password(password):
     """Cria um hash seguro da senha"""
     return hashlib.sha256(password.encode()).hexdigest()
 
+# Colunas de texto com poucos valores distintos, compartilhadas entre variações
+COLUNAS_CATALOGO_REPETIDAS = ('categoria', 'marca', 'tamanho', 'cor')
+
+# Intervalo mínimo (segundos) entre consultas às alterações feitas por outros processos
+INTERVALO_VERIFICACAO_CATALOGO = 1.0
+
+class CatalogoProdutos:
+    """Índice em memória dos produtos por código e por ID
+    
+    Cada produto é guardado como uma tupla na ordem de self.colunas, e os
+    textos repetidos entre variações (marca, tamanho, cor...) são
+    compartilhados, para que catálogos grandes ocupem pouca memória.
+    O índice é carregado na primeira consulta; as funções que alteram
+    produtos chamam invalidar() e as linhas afetadas são relidas do banco
+    no próximo acesso. Alterações feitas por outros processos (outro
+    terminal no mesmo banco) são descobertas pela tabela
+    alteracoes_produtos, consultada no máximo a cada
+    INTERVALO_VERIFICACAO_CATALOGO segundos.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._limpar()
+
+    def _limpar(self):
+        self.colunas = ()
+        self._por_id = None      # id -> tupla com a linha do produto
+        self._por_codigo = {}    # código -> id
+        self._pendentes = set()  # ids que precisam ser relidos do banco
+        self._codigos_pendentes = set()  # códigos que precisam ser relidos (inclusive novos)
+        self._ultima_alteracao = 0  # última linha de alteracoes_produtos já considerada
+        self._verificado_em = 0.0
+
+    def _compactar(self, linha):
+        valores = list(linha)
+        for indice in self._indices_repetidos:
+            if isinstance(valores[indice], str):
+                valores[indice] = sys.intern(valores[indice])
+        return tuple(valores)
+
+    def _atualizar(self):
+        """Carrega o índice completo ou relê os produtos pendentes"""
+        if self._por_id is not None:
+            self._verificar_alteracoes()
+        
+        if self._por_id is None:
+            get_esquema()
+            with conexao() as conn:
+                # Lida antes dos produtos: o que mudar no meio é relido depois
+                self._ultima_alteracao = conn.execute(
+                    "SELECT COALESCE(MAX(seq), 0) FROM alteracoes_produtos"
+                ).fetchone()[0]
+                self._verificado_em = time.monotonic()
+                cursor = conn.execute("SELECT * FROM produtos ORDER BY id")
+                self.colunas = tuple(coluna[0] for coluna in cursor.description)
+                self._i_id = self.colunas.index('id')
+                self._i_codigo = self.colunas.index('codigo')
+                self._indices_repetidos = [
+                    self.colunas.index(coluna) for coluna in COLUNAS_CATALOGO_REPETIDAS
+                    if coluna in self.colunas
+                ]
+                self._por_id = {linha[self._i_id]: self._compactar(linha) for linha in cursor}
+            
+            self._por_codigo = {linha[self._i_codigo]: produto_id for produto_id, linha in self._por_id.items()}
+            self._pendentes.clear()
+            self._codigos_pendentes.clear()
+            return
+        
+        if not self._pendentes and not self._codigos_pendentes:
+            return
+        
+        ids = list(self._pendentes)
+        codigos = list(self._codigos_pendentes)
+        self._pendentes.clear()
+        self._codigos_pendentes.clear()
+        
+        # Código que cada produto tinha antes da releitura. O produto que
+        # tinha um código pendente também é relido pelo ID, pois o código
+        # pode ter passado para outro produto.
+        anteriores = {}
+        for produto_id in ids:
+            linha = self._por_id.get(produto_id)
+            if linha is not None:
+                anteriores[produto_id] = linha[self._i_codigo]
+        for codigo in codigos:
+            produto_id = self._por_codigo.get(codigo)
+            if produto_id is not None:
+                anteriores[produto_id] = codigo
+                ids.append(produto_id)
+        
+        with conexao() as conn:
+            relidos = self._reler(conn, 'id', ids) | self._reler(conn, 'codigo', codigos)
+        
+        for produto_id, codigo in anteriores.items():
+            if produto_id not in relidos:
+                # Produto excluído
+                del self._por_id[produto_id]
+            if self._por_codigo.get(codigo) == produto_id:
+                linha = self._por_id.get(produto_id)
+                if linha is None or linha[self._i_codigo] != codigo:
+                    del self._por_codigo[codigo]
+
+    def _verificar_alteracoes(self):
+        """Marca para releitura os produtos alterados no banco desde a última verificação"""
+        agora = time.monotonic()
+        # Dentro de uma transação a leitura veria alterações ainda não confirmadas
+        if agora - self._verificado_em < INTERVALO_VERIFICACAO_CATALOGO or _gerenciador.profundidade() > 0:
+            return
+        self._verificado_em = agora
+        
+        with conexao() as conn:
+            alteracoes = conn.execute(
+                "SELECT seq, produto_id FROM alteracoes_produtos WHERE seq > ? ORDER BY seq",
+                (self._ultima_alteracao,)
+            ).fetchall()
+        if not alteracoes:
+            return
+        
+        if alteracoes[0][0] > self._ultima_alteracao + 1:
+            # Parte das alterações já foi descartada do registro: recarregar tudo
+            self._limpar()
+            return
+        self._ultima_alteracao = alteracoes[-1][0]
+        self._pendentes.update(produto_id for _, produto_id in alteracoes)
+
+    def _reler(self, conn, coluna, valores):
+        """Relê do banco os produtos cuja coluna (id ou codigo) está em valores
+        
+        Produtos já conhecidos são atualizados na mesma posição; se algum
+        novo tiver ID menor que os existentes, a ordem por ID é refeita.
+        Retorna os IDs relidos.
+        """
+        relidos = set()
+        ultimo_id = next(reversed(self._por_id), 0)
+        fora_de_ordem = False
+        for inicio in range(0, len(valores), 500):
+            lote = valores[inicio:inicio + 500]
+            marcadores = ", ".join("?" * len(lote))
+            cursor = conn.execute(f"SELECT * FROM produtos WHERE {coluna} IN ({marcadores})", lote)
+            for linha in cursor:
+                linha = self._compactar(linha)
+                produto_id = linha[self._i_id]
+                if produto_id not in self._por_id and produto_id < ultimo_id:
+                    fora_de_ordem = True
+                self._por_id[produto_id] = linha
+                self._por_codigo[linha[self._i_codigo]] = produto_id
+                relidos.add(produto_id)
+        
+        if fora_de_ordem:
+            self._por_id = dict(sorted(self._por_id.items()))
+        return relidos
+
+    def _como_dict(self, linha):
+        return dict(zip(self.colunas, linha)) if linha is not None else None
+
+    def id_por_codigo(self, codigo):
+        """Retorna o ID do produto com o código informado, ou None"""
+        with self._lock:
+            self._atualizar()
+            return self._por_codigo.get(codigo)
+
+    def por_codigo(self, codigo):
+        """Retorna o produto (dict) com o código informado, ou None"""
+        with self._lock:
+            self._atualizar()
+            produto_id = self._por_codigo.get(codigo)
+            return self._como_dict(self._por_id.get(produto_id))
+
+    def por_id(self, produto_id):
+        """Retorna o produto (dict) com o ID informado, ou None"""
+        with self._lock:
+            self._atualizar()
+            return self._como_dict(self._por_id.get(produto_id))
+
+    def todos(self):
+        """Retorna todos os produtos como dicts, em ordem de cadastro"""
+        with self._lock:
+            self._atualizar()
+            return [dict(zip(self.colunas, linha)) for linha in self._por_id.values()]
+
+    def invalidar(self, ids=None):
+        """Marca produtos para releitura; sem ids, descarta o índice inteiro"""
+        with self._lock:
+            if ids is None:
+                self._limpar()
+            elif self._por_id is not None:
+                self._pendentes.update(ids)
+
+    def invalidar_codigos(self, codigos):
+        """Marca para releitura os produtos com os códigos informados (novos ou não)"""
+        with self._lock:
+            if self._por_id is not None:
+                self._codigos_pendentes.update(codigos)
+
+
+_catalogo = CatalogoProdutos()
+
+def _invalidar_catalogo_apos_commit(ids=None, codigos=None):
+    """Invalida produtos no catálogo depois que a transação atual for confirmada"""
+    if codigos is not None:
+        _gerenciador.apos_commit(lambda: _catalogo.invalidar_codigos(codigos))
+    else:
+        _gerenciador.apos_commit(lambda: _catalogo.invalidar(ids))
+
+def invalidar_catalogo():
+    """Descarta o catálogo em memória (ex.: após alterar produtos por fora deste módulo)"""
+    _catalogo.invalidar()
+
 def get_produtos():
-    """Retorna a lista de produtos"""
-    conn = get_connection()
-    cursor = conn.cursor()
+    """Retorna a lista de produtos
+    
+    Vem do catálogo em memória; alterações feitas por outro terminal no
+    mesmo banco aparecem em até INTERVALO_VERIFICACAO_CATALOGO segundos.
+    """
+    return _catalogo.todos()
+
+def get_produto_por_codigo(codigo):
+    """Retorna o produto com o código (código de barras) informado, ou None"""
+    return _catalogo.por_codigo(codigo)
+
+def get_produto_por_id(produto_id):
+    """Retorna o produto com o ID informado, ou None"""
+    return _catalogo.por_id(produto_id)
+
+def _termos_busca(texto):
+    """Monta a expressão FTS5 com busca por prefixo em cada palavra digitada"""
+    termos = []
+    for palavra in texto.split():
+        palavra = palavra.replace('"', '""')
+        termos.append(f'"{palavra}"*')
+    return " ".join(termos)
+
+@_instrumentada
+def buscar_produtos(texto, limite=50):
+    """Busca produtos por nome, descrição, marca ou categoria
     
-    cursor.execute("SELECT * FROM produtos")
-    produtos = []
+    Cada palavra é buscada por prefixo ("cam azu" encontra "Camisa Azul").
+    Se o texto for exatamente o código de um produto, ele vem primeiro.
     
-    for row in cursor.fetchall():
-        produto = dict(row)
-        produtos.append(produto)
+    Args:
+        texto: Texto digitado pelo usuário
+        limite: Quantidade máxima de produtos retornados
+        
+    Returns:
+        list: Produtos encontrados, dos mais relevantes para os menos
+    """
+    texto = (texto or "").strip()
+    if not texto:
+        return []
     
-    conn.close()
-    return produtos
+    resultado = []
+    exato = _catalogo.por_codigo(texto)
+    if exato:
+        resultado.append(exato)
+    
+    tem_busca_textual = 'produtos_busca' in get_esquema()["tabelas"]
+    
+    with conexao() as conn:
+        if tem_busca_textual:
+            cursor = conn.execute('''
+            SELECT p.* FROM produtos_busca b
+            JOIN produtos p ON p.id = b.rowid
+            WHERE produtos_busca MATCH ?
+            ORDER BY b.rank
+            LIMIT ?
+            ''', (_termos_busca(texto), limite))
+        else:
+            padrao = f"%{texto}%"
+            cursor = conn.execute('''
+            SELECT * FROM produtos
+            WHERE nome LIKE ? OR descricao LIKE ? OR marca LIKE ? OR categoria LIKE ?
+            ORDER BY nome
+            LIMIT ?
+            ''', (padrao, padrao, padrao, padrao, limite))
+        
+        for row in cursor.fetchall():
+            if not exato or row["id"] != exato["id"]:
+                resultado.append(dict(row))
+    
+    return resultado[:limite]
+
+SQL_ATUALIZAR_PRODUTO_LISTA = '''
+UPDATE produtos SET 
+    codigo = ?,
+    nome = ?,
+    descricao = ?,
+    categoria = ?,
+    tamanho = ?,
+    cor = ?,
+    preco = ?,
+    quantidade = ?,
+    imagem = ?
+WHERE id = ?
+'''
 
+SQL_INSERIR_PRODUTO_LISTA = '''
+INSERT INTO produtos 
+(id, codigo, nome, descricao, categoria, tamanho, cor, preco, quantidade, imagem)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+@_instrumentada
 def save_produtos(produtos):
     """Salva a lista de produtos (compatibilidade com código anterior)"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    
+    atualizacoes = []
+    insercoes = []
     for produto in produtos:
+        valores = (
+            produto["codigo"],
+            produto["nome"],
+            produto.get("descricao", ""),
+            produto.get("categoria", ""),
+            produto["tamanho"],
+            produto["cor"],
+            produto["preco"],
+            produto["quantidade"],
+            produto.get("imagem", "")
+        )
         if "id" in produto and produto["id"]:
             # Atualizar produto existente
-            cursor.execute('''
-            UPDATE produtos SET 
-                codigo = ?,
-                nome = ?,
-                descricao = ?,
-                categoria = ?,
-                tamanho = ?,
-                cor = ?,
-                preco = ?,
-                quantidade = ?,
-                imagem = ?
-            WHERE id = ?
-            ''', (
-                produto["codigo"],
-                produto["nome"],
-                produto.get("descricao", ""),
-                produto.get("categoria", ""),
-                produto["tamanho"],
-                produto["cor"],
-                produto["preco"],
-                produto["quantidade"],
-                produto.get("imagem", ""),
-                produto["id"]
-            ))
+            atualizacoes.append(valores + (produto["id"],))
         else:
-            # Inserir novo produto
+            # Inserir novo produto; id vazio deixa o SQLite escolher
+            insercoes.append((produto.get("id") or None,) + valores)
+    
+    with conexao() as conn:
+        cursor = conn.cursor()
+        if atualizacoes:
+            cursor.executemany(SQL_ATUALIZAR_PRODUTO_LISTA, atualizacoes)
+        if insercoes:
+            cursor.executemany(SQL_INSERIR_PRODUTO_LISTA, insercoes)
+        
+        _invalidar_catalogo_apos_commit()
+
+@_instrumentada
+def add_produto(produto):
+    """Adiciona um novo produto"""
+    try:
+        with conexao() as conn:
+            cursor = conn.cursor()
+            
+            # Verificar se já existe produto com o mesmo código
+            cursor.execute("SELECT id FROM produtos WHERE codigo = ?", (produto["codigo"],))
+            existing = cursor.fetchone()
+        
+            if existing:
+                return -1, "Já existe um produto com este código"
+        
+            # Inserir o produto
             cursor.execute('''
             INSERT INTO produtos 
-            (codigo, nome, descricao, categoria, tamanho, cor, preco, quantidade, imagem)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                (codigo, nome, descricao, preco, quantidade, categoria, marca, tamanho, cor, imagem)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
             ''', (
                 produto["codigo"],
                 produto["nome"],
                 produto.get("descricao", ""),
-                produto.get("categoria", ""),
-                produto["tamanho"],
-                produto["cor"],
                 produto["preco"],
                 produto["quantidade"],
+                produto.get("categoria", ""),
+                produto.get("marca", ""),
+                produto.get("tamanho", ""),
+                produto.get("cor", ""),
                 produto.get("imagem", "")
             ))
-            # Se o produto for novo e tiver um ID específico definido, atualizamos
-            if "id" in produto:
-                last_id = cursor.lastrowid
-                cursor.execute("UPDATE produtos SET id = ? WHERE id = ?", (produto["id"], last_id))
-    
-    conn.commit()
-    conn.close()
-
-def add_produto(produto):
-    """Adiciona um novo produto"""
-    conn = sqlite3.connect(get_database_path())
-    cursor = conn.cursor()
-    
-    try:
-        # Verificar se já existe produto com o mesmo código
-        cursor.execute("SELECT id FROM produtos WHERE codigo = ?", (produto["codigo"],))
-        existing = cursor.fetchone()
         
-        if existing:
-            return -1, "Já existe um produto com este código"
+            produto_id = cursor.lastrowid
+            _invalidar_catalogo_apos_commit([produto_id])
         
-        # Inserir o produto
+            return produto_id, "Produto cadastrado com sucesso!"
+    except Exception as e:
+        print(f"Erro ao adicionar produto: {str(e)}")
+        return -1, f"Não foi possível cadastrar o produto: {str(e)}"
+
+@_instrumentada
+def update_produto(produto):
+    """Atualiza um produto existente"""
+    with conexao() as conn:
+        cursor = conn.cursor()
+    
         cursor.execute('''
-        INSERT INTO produtos 
-            (codigo, nome, descricao, preco, quantidade, categoria, marca, tamanho, cor, imagem)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        UPDATE produtos SET 
+            codigo = ?,
+            nome = ?,
+            descricao = ?,
+            categoria = ?,
+            tamanho = ?,
+            cor = ?,
+            preco = ?,
+            quantidade = ?,
+            imagem = ?
+        WHERE id = ?
         ''', (
             produto["codigo"],
             produto["nome"],
             produto.get("descricao", ""),
-            produto["preco"],
-            produto["quantidade"],
             produto.get("categoria", ""),
-            produto.get("marca", ""),
-            produto.get("tamanho", ""),
+            produto["tamanho"],
             produto.get("cor", ""),
-            produto.get("imagem", "")
+            produto["preco"],
+            produto["quantidade"],
+            produto.get("imagem", ""),
+            produto["id"]
         ))
-        
-        produto_id = cursor.lastrowid
-        conn.commit()
-        
-        return produto_id, "Produto cadastrado com sucesso!"
-    except Exception as e:
-        conn.rollback()
-        print(f"Erro ao adicionar produto: {str(e)}")
-        return -1, f"Não foi possível cadastrar o produto: {str(e)}"
-    finally:
-        conn.close()
-
-def update_produto(produto):
-    """Atualiza um produto existente"""
-    conn = get_connection()
-    cursor = conn.cursor()
+        _invalidar_catalogo_apos_commit([produto["id"]])
     
-    cursor.execute('''
-    UPDATE produtos SET 
-        codigo = ?,
-        nome = ?,
-        descricao = ?,
-        categoria = ?,
-        tamanho = ?,
-        cor = ?,
-        preco = ?,
-        quantidade = ?,
-        imagem = ?
-    WHERE id = ?
-    ''', (
-        produto["codigo"],
-        produto["nome"],
-        produto.get("descricao", ""),
-        produto.get("categoria", ""),
-        produto["tamanho"],
-        produto.get("cor", ""),
-        produto["preco"],
-        produto["quantidade"],
-        produto.get("imagem", ""),
-        produto["id"]
-    ))
-    
-    conn.commit()
-    conn.close()
-    return True
+        return True
 
+@_instrumentada
 def delete_produto(id):
     """Exclui um produto pelo ID"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    
     try:
-        cursor.execute('DELETE FROM produtos WHERE id = ?', (id,))
-        conn.commit()
-        conn.close()
-        return True, "Produto excluído com sucesso"
+        with conexao() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute('DELETE FROM produtos WHERE id = ?', (id,))
+            _invalidar_catalogo_apos_commit([id])
+            return True, "Produto excluído com sucesso"
     except Exception as e:
-        conn.rollback()
-        conn.close()
         return False, f"Erro ao excluir produto: {str(e)}"
 
-def get_vendas():
-    """Retorna a lista de vendas"""
-    conn = get_connection()
-    cursor = conn.cursor()
+# Colunas do catálogo aceitas na importação e gravadas na exportação
+CAMPOS_CATALOGO = ('codigo', 'nome', 'descricao', 'preco', 'quantidade', 'min_quantidade',
+                   'categoria', 'marca', 'tamanho', 'cor', 'imagem')
+CAMPOS_NUMERICOS_CATALOGO = {'preco': float, 'quantidade': int, 'min_quantidade': int}
+# O estoque pode ficar negativo (venda sem estoque) e precisa voltar igual na reimportação
+CAMPOS_CATALOGO_ACEITAM_NEGATIVO = {'quantidade'}
+# '1.000' ou '12.345.678': ponto como separador de milhar (em preço é ambíguo)
+NUMERO_COM_MILHAR = re.compile(r'^-?\d{1,3}(\.\d{3})+$')
+
+# Linhas gravadas por transação durante a importação
+TAMANHO_LOTE_IMPORTACAO = 5000
+
+@contextmanager
+def _abrir_arquivo(arquivo, modo):
+    """Abre um caminho em UTF-8 ou repassa um objeto de arquivo já aberto"""
+    if hasattr(arquivo, 'read') or hasattr(arquivo, 'write'):
+        yield arquivo
+        return
+    codificacao = 'utf-8-sig' if 'r' in modo else 'utf-8'
+    with open(arquivo, modo, encoding=codificacao, newline='') as f:
+        yield f
+
+def _formato_arquivo(arquivo, formato=None):
+    """Retorna 'csv' ou 'jsonl' a partir do parâmetro ou da extensão do arquivo"""
+    if formato:
+        formato = formato.lower()
+    else:
+        nome = arquivo if isinstance(arquivo, (str, os.PathLike)) else getattr(arquivo, 'name', '')
+        extensao = os.path.splitext(str(nome))[1].lower()
+        formato = 'jsonl' if extensao in ('.jsonl', '.ndjson', '.json') else 'csv'
+    if formato not in ('csv', 'jsonl'):
+        raise ValueError(f"Formato de arquivo não suportado: {formato}")
+    return formato
+
+def _ler_csv(f):
+    """Gera (linha, registro) do CSV sem carregar o arquivo inteiro; detecta ';' ou ','"""
+    delimitador = ';'
+    if f.seekable():
+        amostra = f.read(8192)
+        f.seek(0)
+        try:
+            delimitador = csv.Sniffer().sniff(amostra, delimiters=';,\t').delimiter
+        except csv.Error:
+            pass
+    
+    leitor = csv.reader(f, delimiter=delimitador)
+    cabecalho = next(leitor, None)
+    if cabecalho is None:
+        return
+    cabecalho = [coluna.strip().lower() for coluna in cabecalho]
+    
+    for valores in leitor:
+        if not any(valor.strip() for valor in valores):
+            continue
+        yield leitor.line_num, dict(zip(cabecalho, valores))
+
+def _ler_jsonl(f):
+    """Gera (linha, registro) de um arquivo JSON Lines; linhas inválidas viram ValueError"""
+    for numero, texto in enumerate(f, 1):
+        texto = texto.strip()
+        if not texto:
+            continue
+        try:
+            registro = json.loads(texto)
+        except ValueError as e:
+            yield numero, ValueError(f"JSON inválido: {e.msg}")
+            continue
+        if not isinstance(registro, dict):
+            yield numero, ValueError("Cada linha deve ser um objeto JSON")
+            continue
+        yield numero, {str(chave).strip().lower(): valor for chave, valor in registro.items()}
+
+def _numero_importado(campo, valor):
+    """Converte texto como '1.234,56', '1.000' ou '19.90'; retorna None para campo vazio"""
+    tipo = CAMPOS_NUMERICOS_CATALOGO[campo]
+    if isinstance(valor, str):
+        valor = valor.strip()
+        if not valor:
+            return None
+        if ',' in valor:
+            valor = valor.replace('.', '').replace(',', '.')
+        elif NUMERO_COM_MILHAR.match(valor):
+            if tipo is not int:
+                raise ValueError(f"Valor ambíguo para {campo}: {valor} (use vírgula para os decimais)")
+            valor = valor.replace('.', '')
+    elif valor is None:
+        return None
+    elif isinstance(valor, bool):
+        raise ValueError(f"Valor inválido para {campo}: {valor}")
+    
+    try:
+        numero = float(valor)
+    except (TypeError, ValueError):
+        raise ValueError(f"Valor inválido para {campo}: {valor}")
+    if numero != numero or (numero < 0 and campo not in CAMPOS_CATALOGO_ACEITAM_NEGATIVO):
+        raise ValueError(f"Valor inválido para {campo}: {valor}")
+    if tipo is int:
+        if not numero.is_integer():
+            raise ValueError(f"{campo} deve ser um número inteiro: {valor}")
+        return int(numero)
+    return numero
+
+def _normalizar_produto_importado(registro):
+    """Valida uma linha importada e retorna só as colunas conhecidas que foram informadas"""
+    produto = {}
+    for campo in CAMPOS_CATALOGO:
+        if campo not in registro:
+            continue
+        valor = registro[campo]
+        if campo in CAMPOS_NUMERICOS_CATALOGO:
+            valor = _numero_importado(campo, valor)
+            if valor is not None:
+                produto[campo] = valor
+        else:
+            valor = "" if valor is None else str(valor).strip()
+            if valor:
+                produto[campo] = valor
+    
+    if not produto.get('codigo'):
+        raise ValueError("Código do produto não informado")
+    return produto
+
+def _comando_importacao(produto, novo):
+    """Monta o SQL de gravação para o conjunto de colunas da linha"""
+    colunas = tuple(produto)
+    if novo:
+        # O upsert cobre o produto cadastrado por outro processo durante a importação
+        atribuicoes = ", ".join(f"{coluna} = excluded.{coluna}" for coluna in colunas if coluna != 'codigo')
+        return f'''
+        INSERT INTO produtos ({", ".join(colunas)})
+        VALUES ({", ".join("?" * len(colunas))})
+        ON CONFLICT(codigo) DO UPDATE SET {atribuicoes}, updated_at = CURRENT_TIMESTAMP
+        ''', colunas
+    
+    # Produto existente vai por UPDATE: o SQLite valida NOT NULL antes do
+    # ON CONFLICT (linhas parciais falhariam) e cada upsert consome um valor
+    # do AUTOINCREMENT mesmo quando acaba atualizando
+    colunas = tuple(coluna for coluna in colunas if coluna != 'codigo')
+    atribuicoes = ", ".join(f"{coluna} = ?" for coluna in colunas)
+    return f'''
+    UPDATE produtos SET {atribuicoes}, updated_at = CURRENT_TIMESTAMP
+    WHERE codigo = ?
+    ''', colunas + ('codigo',)
+
+def _gravar_lote_importacao(lote, erros):
+    """Grava um lote de linhas validadas; retorna quantas foram gravadas.
     
-    # Verificar se a coluna data_venda existe
-    cursor.execute("PRAGMA table_info(vendas)")
-    colunas = cursor.fetchall()
-    tem_data_venda = any(coluna[1] == 'data_venda' for coluna in colunas)
+    Linhas consecutivas com as mesmas colunas vão num único executemany. Se o
+    lote falhar, ou se algum UPDATE não encontrar o produto (o catálogo pode
+    não ter visto ainda uma exclusão feita em outro terminal), ele é refeito
+    linha a linha para apontar quais linhas têm erro.
+    """
+    grupos = []
+    for linha, produto, novo in lote:
+        comando = _comando_importacao(produto, novo)
+        if grupos and grupos[-1][0] == comando:
+            grupos[-1][1].append((linha, produto))
+        else:
+            grupos.append((comando, [(linha, produto)]))
     
-    # Buscar vendas
+    codigos = [produto['codigo'] for _, produto, _ in lote]
     try:
-        if tem_data_venda:
-            cursor.execute('SELECT * FROM vendas ORDER BY data_venda DESC')
+        with conexao(imediata=True) as conn:
+            for (sql, colunas), linhas in grupos:
+                cursor = conn.executemany(sql, [tuple(produto[c] for c in colunas) for _, produto in linhas])
+                if cursor.rowcount != len(linhas):
+                    # Desfaz o lote; a gravação linha a linha identifica o produto que sumiu
+                    raise LookupError("Produto não encontrado")
+            _invalidar_catalogo_apos_commit(codigos=codigos)
+        return len(lote)
+    except (sqlite3.IntegrityError, LookupError):
+        pass
+    
+    gravados = 0
+    with conexao(imediata=True) as conn:
+        for (sql, colunas), linhas in grupos:
+            for linha, produto in linhas:
+                try:
+                    cursor = conn.execute(sql, tuple(produto[c] for c in colunas))
+                    if cursor.rowcount == 0:
+                        erros.append((linha, produto['codigo'], "Produto não encontrado; pode ter sido excluído em outro terminal"))
+                        continue
+                    gravados += 1
+                except sqlite3.IntegrityError as e:
+                    erros.append((linha, produto['codigo'], f"Erro ao gravar: {e}"))
+        _invalidar_catalogo_apos_commit(codigos=codigos)
+    return gravados
+
+@_instrumentada
+def importar_produtos(arquivo, formato=None, tamanho_lote=TAMANHO_LOTE_IMPORTACAO, progresso=None):
+    """Importa o catálogo de um CSV ou JSON Lines, criando ou atualizando produtos pelo código.
+    
+    O arquivo é lido linha a linha e gravado em lotes de tamanho_lote por
+    transação, então arquivos grandes não são carregados na memória. Linhas
+    com nome e preço criam o produto ou atualizam o existente; linhas sem
+    eles (ex.: só código e preço) apenas atualizam produtos já cadastrados.
+    Colunas ausentes ou vazias mantêm o valor atual. Quantidade pode ser
+    negativa, como o estoque exportado; preço e estoque mínimo não.
+    
+    progresso, se informado, é chamado após cada lote com
+    (linhas_lidas, produtos_gravados, quantidade_de_erros).
+    
+    Retorna {'lidos', 'importados', 'erros'}, sendo erros uma lista de
+    (linha, codigo, mensagem) das linhas rejeitadas.
+    """
+    get_esquema()
+    formato = _formato_arquivo(arquivo, formato)
+    resultado = {'lidos': 0, 'importados': 0, 'erros': []}
+    erros = resultado['erros']
+    
+    with _abrir_arquivo(arquivo, 'r') as f:
+        registros = _ler_csv(f) if formato == 'csv' else _ler_jsonl(f)
+        lote = []
+        novos_no_lote = set()
+        informado = None  # último (lidos, importados, erros) passado a progresso
+        
+        for linha, registro in registros:
+            resultado['lidos'] += 1
+            codigo = registro.get('codigo') if isinstance(registro, dict) else None
+            try:
+                if isinstance(registro, Exception):
+                    raise registro
+                produto = _normalizar_produto_importado(registro)
+                codigo = produto['codigo']
+                novo = codigo not in novos_no_lote and _catalogo.id_por_codigo(codigo) is None
+                if novo:
+                    if 'nome' not in produto or 'preco' not in produto:
+                        raise ValueError("Produto não cadastrado; informe nome e preço para criá-lo")
+                    novos_no_lote.add(codigo)
+            except ValueError as e:
+                erros.append((linha, codigo, str(e)))
+                continue
+            
+            lote.append((linha, produto, novo))
+            if len(lote) >= tamanho_lote:
+                resultado['importados'] += _gravar_lote_importacao(lote, erros)
+                lote = []
+                novos_no_lote.clear()
+                if progresso:
+                    informado = (resultado['lidos'], resultado['importados'], len(erros))
+                    progresso(*informado)
+        
+        if lote:
+            resultado['importados'] += _gravar_lote_importacao(lote, erros)
+        # Sem repetir o último aviso quando o arquivo terminou junto com um lote
+        if progresso and informado != (resultado['lidos'], resultado['importados'], len(erros)):
+            progresso(resultado['lidos'], resultado['importados'], len(erros))
+    
+    return resultado
+
+def _valor_exportado(valor):
+    """Formata um valor para o CSV sem gerar números que a importação leria como milhar"""
+    if valor is None:
+        return ""
+    if isinstance(valor, float):
+        texto = repr(valor)
+        if NUMERO_COM_MILHAR.match(texto):
+            return texto.replace('.', ',')
+    return valor
+
+@_instrumentada
+def exportar_produtos(arquivo, formato=None, delimitador=';'):
+    """Exporta o catálogo para CSV ou JSON Lines sem montar a lista em memória.
+    
+    O arquivo gerado pode ser reimportado com importar_produtos. Retorna a
+    quantidade de produtos exportados.
+    """
+    formato = _formato_arquivo(arquivo, formato)
+    colunas = [coluna for coluna in CAMPOS_CATALOGO if coluna in get_esquema()["tabelas"]["produtos"]]
+    exportados = 0
+    
+    with _abrir_arquivo(arquivo, 'w') as f, conexao() as conn:
+        cursor = conn.execute(f"SELECT {', '.join(colunas)} FROM produtos ORDER BY id")
+        if formato == 'csv':
+            escritor = csv.writer(f, delimiter=delimitador, lineterminator='\n')
+            escritor.writerow(colunas)
+            for row in cursor:
+                escritor.writerow([_valor_exportado(valor) for valor in row])
+                exportados += 1
         else:
-            # Caso a coluna não exista, tentar usar 'data' (nome antigo)
-            cursor.execute('SELECT * FROM vendas ORDER BY data DESC')
-    except sqlite3.OperationalError:
-        # Erro na consulta - tentar ordenar pelo ID
-        cursor.execute('SELECT * FROM vendas ORDER BY id DESC')
+            for row in cursor:
+                f.write(json.dumps(dict(zip(colunas, row)), ensure_ascii=False))
+                f.write('\n')
+                exportados += 1
     
-    vendas_rows = cursor.fetchall()
+    return exportados
+
+# Quantidade de vendas por página na listagem paginada do histórico
+TAMANHO_PAGINA_VENDAS = 200
+
+def _agrupar_itens(cursor, vendas):
+    """Anexa a cada venda (em venda["itens"]) os itens já consultados no cursor
     
-    vendas = []
-    for venda_row in vendas_rows:
-        venda = dict(venda_row)
-        
-        # Buscar itens da venda
-        cursor.execute('''
-        SELECT * FROM itens_venda WHERE venda_id = ?
-        ''', (venda["id"],))
-        
-        itens = [dict(item) for item in cursor.fetchall()]
-        venda["itens"] = itens
-        
-        vendas.append(venda)
+    O cursor deve conter linhas de itens_venda; itens de vendas que não
+    estão na lista são ignorados.
+    """
+    por_venda = {}
+    for venda in vendas:
+        venda["itens"] = []
+        por_venda[venda["id"]] = venda
+    
+    for item in cursor:
+        venda = por_venda.get(item["venda_id"])
+        if venda is not None:
+            venda["itens"].append(dict(item))
     
-    conn.close()
     return vendas
 
+@_instrumentada
+def get_vendas():
+    """Retorna a lista de vendas"""
+    get_esquema()
+    
+    with conexao() as conn:
+        cursor = conn.cursor()
+    
+        # Buscar vendas
+        cursor.execute('SELECT * FROM vendas ORDER BY data_venda DESC')
+        vendas = [dict(venda_row) for venda_row in cursor.fetchall()]
+    
+        # Buscar os itens de todas as vendas numa única consulta
+        cursor.execute('SELECT * FROM itens_venda ORDER BY venda_id, id')
+        return _agrupar_itens(cursor, vendas)
+
+# Comandos fixos do registro de vendas (o esquema é garantido pelas migrações)
+SQL_INSERIR_VENDA = '''
+INSERT INTO vendas 
+    (usuario_id, valor_total, forma_pagamento, codigo, desconto, data_venda)
+VALUES
+    (?, ?, ?, ?, ?, ?)
+'''
+
+SQL_INSERIR_ITEM_VENDA = '''
+INSERT INTO itens_venda 
+    (venda_id, produto_id, quantidade, preco_unitario, subtotal)
+VALUES
+    (?, ?, ?, ?, ?)
+'''
+
+SQL_BAIXAR_ESTOQUE = '''
+UPDATE produtos 
+SET quantidade = quantidade - ?
+WHERE id = ?
+'''
+
+SQL_ACUMULAR_RESUMO_VENDAS = '''
+INSERT INTO resumo_vendas_dia 
+    (dia, forma_pagamento, quantidade_vendas, valor_total, desconto_total)
+VALUES
+    (?, ?, 1, ?, ?)
+ON CONFLICT (dia, forma_pagamento) DO UPDATE SET
+    quantidade_vendas = quantidade_vendas + 1,
+    valor_total = valor_total + excluded.valor_total,
+    desconto_total = desconto_total + excluded.desconto_total
+'''
+
+SQL_ACUMULAR_RESUMO_PRODUTOS = '''
+INSERT INTO resumo_produtos_dia 
+    (dia, produto_id, quantidade, valor_total)
+VALUES
+    (?, ?, ?, ?)
+ON CONFLICT (dia, produto_id) DO UPDATE SET
+    quantidade = quantidade + excluded.quantidade,
+    valor_total = valor_total + excluded.valor_total
+'''
+
+def _id_produto(cursor, codigo):
+    """Retorna o ID do produto pelo código, consultando primeiro o catálogo em memória"""
+    produto_id = _catalogo.id_por_codigo(codigo)
+    if produto_id is None:
+        # Produto cadastrado por outro terminal depois da carga do catálogo
+        cursor.execute("SELECT id FROM produtos WHERE codigo = ?", (codigo,))
+        produto = cursor.fetchone()
+        if produto:
+            produto_id = produto[0]
+            _catalogo.invalidar([produto_id])
+    return produto_id
+
+def _normalizar_venda(venda, valor_total=None, forma_pagamento=None, desconto=0):
+    """Extrai os dados gravados de uma venda (dicionário ou lista de itens)
+    
+    O resultado só tem tipos simples, para poder ir para o diário da fila de vendas.
+    """
+    # Se recebermos um objeto venda, extrai os valores dele
+    if isinstance(venda, dict):
+        # Usar valores do objeto venda se fornecidos
+        codigo = venda.get("codigo", f"V{datetime.now().strftime('%Y%m%d%H%M%S')}")
+        subtotal = venda.get("subtotal", 0)
+        if valor_total is None:
+            valor_total = venda.get("total", subtotal)
+        if forma_pagamento is None:
+            forma_pagamento = venda.get("forma_pagamento", "Dinheiro")
+        desconto = venda.get("desconto", desconto)
+        itens_venda = venda.get("itens", [])
+    else:
+        # Se não for um dicionário, usamos os parâmetros individuais
+        # e venda é tratado como itens_venda
+        itens_venda = venda
+        codigo = f"V{datetime.now().strftime('%Y%m%d%H%M%S')}"
+    
+    return {
+        "codigo": codigo,
+        "valor_total": valor_total,
+        "forma_pagamento": forma_pagamento,
+        "desconto": desconto,
+        "data_venda": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "itens": [
+            {campo: item.get(campo) for campo in ("codigo", "quantidade", "preco", "subtotal")}
+            for item in itens_venda or []
+        ]
+    }
+
+def _gravar_vendas(cursor, vendas):
+    """Grava vendas normalizadas na transação atual e retorna os IDs, na mesma ordem
+    
+    Cada venda é um INSERT (para obter o ID); itens, baixas de estoque e
+    resumos diários de todas as vendas vão num executemany cada.
+    """
+    # Obter ID do usuário atual (para simplificar, usando 1 como padrão)
+    usuario_id = 1
+    
+    ids = []
+    resumos_vendas = []
+    itens = []
+    baixas = []
+    resumos_produtos = []
+    produtos_vendidos = []
+    
+    for venda in vendas:
+        cursor.execute(SQL_INSERIR_VENDA, (
+            usuario_id,
+            venda["valor_total"],
+            venda["forma_pagamento"],
+            venda["codigo"],
+            venda["desconto"],
+            venda["data_venda"]
+        ))
+        venda_id = cursor.lastrowid
+        ids.append(venda_id)
+        dia = venda["data_venda"][:10]
+        
+        resumos_vendas.append((dia, venda["forma_pagamento"] or '', venda["valor_total"] or 0, venda["desconto"] or 0))
+        
+        for item in venda["itens"]:
+            # Itens com código desconhecido são ignorados
+            produto_id = _id_produto(cursor, item["codigo"])
+            if produto_id is None:
+                continue
+            produtos_vendidos.append(produto_id)
+            itens.append((venda_id, produto_id, item["quantidade"], item["preco"], item["subtotal"]))
+            baixas.append((item["quantidade"], produto_id))
+            resumos_produtos.append((dia, produto_id, item["quantidade"], item["subtotal"]))
+    
+    # Resumos diários atualizados na mesma transação das vendas
+    cursor.executemany(SQL_ACUMULAR_RESUMO_VENDAS, resumos_vendas)
+    cursor.executemany(SQL_INSERIR_ITEM_VENDA, itens)
+    cursor.executemany(SQL_BAIXAR_ESTOQUE, baixas)
+    cursor.executemany(SQL_ACUMULAR_RESUMO_PRODUTOS, resumos_produtos)
+    
+    # O estoque em memória é relido depois do commit
+    _invalidar_catalogo_apos_commit(produtos_vendidos)
+    
+    return ids
+
+@_instrumentada
 def registrar_venda(venda, valor_total=None, forma_pagamento=None, desconto=0, valor_recebido=0, troco=0):
     """Registra uma venda no banco de dados
     
@@ -722,512 +2169,979 @@ def registrar_venda(venda, valor_total=None, forma_pagamento=None, desconto=0, v
         int: ID da venda registrada
     """
     try:
-        conn = sqlite3.connect(get_database_path())
-        cursor = conn.cursor()
+        get_esquema()
         
-        # Verificar colunas da tabela vendas
-        cursor.execute("PRAGMA table_info(vendas)")
-        colunas = [coluna[1] for coluna in cursor.fetchall()]
-        
-        # Se recebermos um objeto venda, extrai os valores dele
-        if isinstance(venda, dict):
-            # Usar valores do objeto venda se fornecidos
-            codigo = venda.get("codigo", f"V{datetime.now().strftime('%Y%m%d%H%M%S')}")
-            subtotal = venda.get("subtotal", 0)
-            if valor_total is None:
-                valor_total = venda.get("total", subtotal)
-            if forma_pagamento is None:
-                forma_pagamento = venda.get("forma_pagamento", "Dinheiro")
-            desconto = venda.get("desconto", desconto)
-            valor_recebido = venda.get("valor_recebido", valor_recebido)
-            troco = venda.get("troco", troco)
-            itens_venda = venda.get("itens", [])
-        else:
-            # Se não for um dicionário, usamos os parâmetros individuais
-            # e venda é tratado como itens_venda
-            itens_venda = venda
-            codigo = f"V{datetime.now().strftime('%Y%m%d%H%M%S')}"
-            subtotal = valor_total
-        
-        # Obter ID do usuário atual (para simplificar, usando 1 como padrão)
-        usuario_id = 1
-        
-        # Construir a consulta SQL de acordo com as colunas disponíveis
-        campos = []
-        valores = []
-        valores_placeholders = []
-        
-        # Sempre incluir estas colunas básicas
-        if 'usuario_id' in colunas:
-            campos.append('usuario_id')
-            valores.append(usuario_id)
-            valores_placeholders.append('?')
-            
-        if 'valor_total' in colunas:
-            campos.append('valor_total')
-            valores.append(valor_total)
-            valores_placeholders.append('?')
-            
-        if 'forma_pagamento' in colunas:
-            campos.append('forma_pagamento')
-            valores.append(forma_pagamento)
-            valores_placeholders.append('?')
-            
-        if 'codigo' in colunas:
-            campos.append('codigo')
-            valores.append(codigo)
-            valores_placeholders.append('?')
-            
-        if 'desconto' in colunas:
-            campos.append('desconto')
-            valores.append(desconto)
-            valores_placeholders.append('?')
-        
-        # Adicionar coluna de data se existir
-        if 'data_venda' in colunas:
-            campos.append('data_venda')
-            valores.append(datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
-            valores_placeholders.append('?')
-        
-        # Criar a consulta SQL
-        sql = f"""
-        INSERT INTO vendas 
-            ({', '.join(campos)})
-        VALUES
-            ({', '.join(valores_placeholders)})
-        """
-        
-        cursor.execute(sql, valores)
-        venda_id = cursor.lastrowid
+        dados = _normalizar_venda(venda, valor_total, forma_pagamento, desconto)
         
-        # Verificar se a tabela itens_venda existe
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='itens_venda'")
-        tem_tabela_itens = cursor.fetchone() is not None
-        
-        if tem_tabela_itens and itens_venda:
-            # Registrar itens da venda na tabela itens_venda
-            for item in itens_venda:
-                # Obter produto pelo código
-                codigo_produto = item["codigo"]
-                cursor.execute("SELECT id FROM produtos WHERE codigo = ?", (codigo_produto,))
-                produto = cursor.fetchone()
-                
-                if produto:
-                    produto_id = produto[0]
-                    cursor.execute('''
-                    INSERT INTO itens_venda 
-                        (venda_id, produto_id, quantidade, preco_unitario, subtotal)
-                    VALUES
-                        (?, ?, ?, ?, ?)
-                    ''', (
-                        venda_id,
-                        produto_id,
-                        item["quantidade"],
-                        item["preco"],
-                        item["subtotal"]
-                    ))
-                    
-                    # Atualizar estoque do produto
-                    cursor.execute('''
-                    UPDATE produtos 
-                    SET quantidade = quantidade - ?
-                    WHERE id = ?
-                    ''', (item["quantidade"], produto_id))
-        
-        conn.commit()
-        return venda_id
+        with conexao() as conn:
+            return _gravar_vendas(conn.cursor(), [dados])[0]
     except Exception as e:
         print(f"Erro ao registrar venda: {str(e)}")
-        if conn:
-            conn.rollback()
         raise e
-    finally:
-        if conn:
-            conn.close()
 
+# Limites usados quando apenas uma das datas do período é informada
+DATA_MINIMA = "0000-01-01 00:00:00"
+DATA_MAXIMA = "9999-12-31 23:59:59"
+
+def _periodo(data_inicio=None, data_fim=None):
+    """Normaliza o período de consulta para comparação com data_venda"""
+    if data_fim and not ' ' in data_fim:
+        # Garantir que inclua todo o último dia
+        data_fim = data_fim + " 23:59:59"
+    return data_inicio or DATA_MINIMA, data_fim or DATA_MAXIMA
+
+@_instrumentada
 def get_relatorio_vendas(data_inicio=None, data_fim=None):
     """Retorna as vendas realizadas em um determinado período"""
-    conn = get_connection()
-    cursor = conn.cursor()
+    get_esquema()
     
-    # Verificar se a coluna data_venda existe
-    cursor.execute("PRAGMA table_info(vendas)")
-    colunas = cursor.fetchall()
-    tem_data_venda = any(coluna[1] == 'data_venda' for coluna in colunas)
-    coluna_data = 'data_venda' if tem_data_venda else 'data'
-    
-    query = "SELECT * FROM vendas"
-    params = []
+    with conexao() as conn:
+        cursor = conn.cursor()
     
-    if data_inicio or data_fim:
-        query += " WHERE "
-        
-        if data_inicio:
-            query += f"{coluna_data} >= ?"
-            params.append(data_inicio)
+        if data_inicio or data_fim:
+            periodo = _periodo(data_inicio, data_fim)
             
-            if data_fim:
-                query += " AND "
-        
-        if data_fim:
-            query += f"{coluna_data} <= ?"
-            # Garantir que inclua todo o último dia
-            if not ' ' in data_fim:
-                data_fim = data_fim + " 23:59:59"
-            params.append(data_fim)
-    
-    query += f" ORDER BY {coluna_data} DESC"
-    
-    try:
-        cursor.execute(query, params)
-    except sqlite3.OperationalError as e:
-        print(f"Erro ao buscar vendas: {str(e)}")
-        # Se ocorrer erro, tenta consulta sem filtro por data
-        try:
-            cursor.execute("SELECT * FROM vendas ORDER BY id DESC")
-        except sqlite3.OperationalError:
-            # Se ainda ocorrer erro, pode ser que a tabela não exista
-            return []
-    
-    vendas_rows = cursor.fetchall()
-    
-    vendas = []
-    for venda_row in vendas_rows:
-        venda = dict(venda_row)
-        
-        # Buscar itens da venda
-        try:
             cursor.execute('''
-            SELECT * FROM itens_venda WHERE venda_id = ?
-            ''', (venda["id"],))
+            SELECT * FROM vendas
+            WHERE data_venda >= ? AND data_venda <= ?
+            ORDER BY data_venda DESC
+            ''', periodo)
+            vendas = [dict(venda_row) for venda_row in cursor.fetchall()]
             
-            itens = [dict(item) for item in cursor.fetchall()]
-            venda["itens"] = itens
-        except sqlite3.OperationalError:
-            # Se não encontrar a tabela de itens
-            venda["itens"] = []
-        
-        vendas.append(venda)
+            # Itens das vendas do período numa única consulta
+            cursor.execute('''
+            SELECT iv.* FROM itens_venda iv
+            JOIN vendas v ON v.id = iv.venda_id
+            WHERE v.data_venda >= ? AND v.data_venda <= ?
+            ORDER BY iv.venda_id, iv.id
+            ''', periodo)
+        else:
+            cursor.execute("SELECT * FROM vendas ORDER BY data_venda DESC")
+            vendas = [dict(venda_row) for venda_row in cursor.fetchall()]
+            
+            cursor.execute("SELECT * FROM itens_venda ORDER BY venda_id, id")
     
-    conn.close()
-    return vendas
+        return _agrupar_itens(cursor, vendas)
+
+def _anexar_itens_pagina(cursor, vendas):
+    """Busca numa única consulta os itens das vendas de uma página"""
+    if not vendas:
+        return vendas
+    
+    marcadores = ", ".join("?" * len(vendas))
+    cursor.execute(
+        f"SELECT * FROM itens_venda WHERE venda_id IN ({marcadores}) ORDER BY venda_id, id",
+        [venda["id"] for venda in vendas]
+    )
+    return _agrupar_itens(cursor, vendas)
 
-def get_caixa():
-    """Retorna os dados do caixa atual"""
-    conn = get_connection()
-    cursor = conn.cursor()
+@_instrumentada
+def get_vendas_pagina(apos=None, tamanho_pagina=TAMANHO_PAGINA_VENDAS,
+                      data_inicio=None, data_fim=None, com_itens=True):
+    """Retorna uma página do histórico de vendas, da mais recente para a mais antiga
     
-    cursor.execute("SELECT * FROM caixa ORDER BY id DESC LIMIT 1")
-    result = cursor.fetchone()
+    A paginação é por chave (data_venda, id): em vez de OFFSET, cada página
+    continua a partir da última venda da página anterior, então o custo não
+    cresce com o tamanho do histórico.
     
-    # Se não há caixa, criar um caixa fechado
-    if not result:
-        cursor.execute('''
-        INSERT INTO caixa 
-        (saldo_inicial, saldo_atual, ultima_atualizacao)
-        VALUES (?, ?, ?)
-        ''', (0, 0, datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
-        conn.commit()
+    Args:
+        apos: Cursor retornado pela página anterior (None para a primeira página)
+        tamanho_pagina: Quantidade máxima de vendas na página
+        data_inicio: Data inicial do período (opcional)
+        data_fim: Data final do período (opcional)
+        com_itens: Se True, inclui os itens de cada venda em venda["itens"]
         
-        cursor.execute("SELECT * FROM caixa ORDER BY id DESC LIMIT 1")
-        result = cursor.fetchone()
+    Returns:
+        tuple: (lista de vendas, cursor da próxima página ou None se acabou)
+    """
+    get_esquema()
     
-    caixa = dict(result)
+    filtro_periodo = ""
+    params_periodo = ()
+    if data_inicio or data_fim:
+        filtro_periodo = " AND data_venda >= ? AND data_venda <= ?"
+        params_periodo = _periodo(data_inicio, data_fim)
     
-    # Buscar movimentações
-    cursor.execute("SELECT * FROM movimentos_caixa ORDER BY data DESC LIMIT 100")
-    movimentacoes = [dict(mov) for mov in cursor.fetchall()]
+    with conexao() as conn:
+        cursor = conn.cursor()
+        
+        if apos is None:
+            cursor.execute(
+                "SELECT * FROM vendas WHERE 1 = 1" + filtro_periodo +
+                " ORDER BY data_venda DESC, id DESC LIMIT ?",
+                params_periodo + (tamanho_pagina,)
+            )
+            vendas = [dict(row) for row in cursor.fetchall()]
+        elif apos[0] is not None:
+            cursor.execute(
+                "SELECT * FROM vendas WHERE (data_venda, id) < (?, ?)" + filtro_periodo +
+                " ORDER BY data_venda DESC, id DESC LIMIT ?",
+                tuple(apos) + params_periodo + (tamanho_pagina,)
+            )
+            vendas = [dict(row) for row in cursor.fetchall()]
+            
+            # Vendas antigas sem data_venda vêm depois de todas as datadas
+            if len(vendas) < tamanho_pagina and not params_periodo:
+                cursor.execute(
+                    "SELECT * FROM vendas WHERE data_venda IS NULL ORDER BY id DESC LIMIT ?",
+                    (tamanho_pagina - len(vendas),)
+                )
+                vendas.extend(dict(row) for row in cursor.fetchall())
+        else:
+            cursor.execute(
+                "SELECT * FROM vendas WHERE data_venda IS NULL AND id < ? ORDER BY id DESC LIMIT ?",
+                (apos[1], tamanho_pagina)
+            )
+            vendas = [dict(row) for row in cursor.fetchall()]
+        
+        if com_itens:
+            _anexar_itens_pagina(cursor, vendas)
     
-    caixa["movimentacoes"] = movimentacoes
+    if len(vendas) < tamanho_pagina:
+        return vendas, None
     
-    # Determinar o status do caixa baseado nas movimentações
-    caixa["status"] = "fechado"  # Status padrão é fechado
+    ultima = vendas[-1]
+    return vendas, (ultima["data_venda"], ultima["id"])
+
+def iterar_vendas(data_inicio=None, data_fim=None, tamanho_pagina=TAMANHO_PAGINA_VENDAS, com_itens=True):
+    """Percorre o histórico de vendas página a página, com memória constante
     
-    if movimentacoes:
-        # Procurar pela última movimentação de abertura ou fechamento
-        for mov in movimentacoes:
-            if "abertura de caixa" in mov["descricao"].lower():
-                caixa["status"] = "aberto"
-                break
-            elif "fechamento de caixa" in mov["descricao"].lower():
-                caixa["status"] = "fechado"
-                break
-        
-        # Se tiver movimentações e o saldo atual for maior que zero, considerar aberto
-        if caixa["status"] == "fechado" and caixa["saldo_atual"] > 0:
-            caixa["status"] = "aberto"
+    Cada página é lida numa consulta curta; nenhuma transação fica aberta
+    entre uma página e outra.
     
-    conn.close()
-    return caixa
+    Yields:
+        dict: Cada venda, da mais recente para a mais antiga
+    """
+    apos = None
+    while True:
+        vendas, apos = get_vendas_pagina(apos, tamanho_pagina, data_inicio, data_fim, com_itens)
+        yield from vendas
+        if apos is None:
+            break
 
-def get_movimentos_caixa():
-    """Retorna as movimentações do caixa"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    
-    try:
-        cursor.execute("SELECT * FROM movimentos_caixa ORDER BY data DESC")
-        movimentos = [dict(row) for row in cursor.fetchall()]
-        return movimentos
-    except sqlite3.OperationalError as e:
-        print(f"Erro ao buscar movimentos do caixa: {str(e)}")
-        return []
-    finally:
-        conn.close()
+# Terminal usado quando a loja tem um único caixa
+TERMINAL_PADRAO = "principal"
 
-def registrar_movimento_caixa(tipo, descricao, valor):
-    """Registra um movimento no caixa (entrada ou saída)"""
-    conn = get_connection()
-    cursor = conn.cursor()
+# Tipos de movimento que somam no caixa; os demais (exceto os de controle) subtraem
+TIPOS_ENTRADA_CAIXA = ('entrada', 'venda')
+
+# Movimentos que só marcam abertura/fechamento e não entram nos totais
+TIPOS_CONTROLE_CAIXA = ('abertura', 'fechamento')
+
+SQL_SESSAO_ATUAL = '''
+SELECT * FROM sessoes_caixa
+WHERE terminal = ?
+ORDER BY id DESC LIMIT 1
+'''
+
+SQL_SESSAO_ABERTA = '''
+SELECT * FROM sessoes_caixa
+WHERE terminal = ? AND status = 'aberto'
+'''
+
+SQL_INSERIR_MOVIMENTO_CAIXA = '''
+INSERT INTO movimentos_caixa 
+(data, tipo, descricao, valor, sessao_id)
+VALUES (?, ?, ?, ?, ?)
+'''
+
+SQL_ACUMULAR_TOTAL_SESSAO = '''
+INSERT INTO totais_sessao_caixa 
+    (sessao_id, tipo, quantidade, total)
+VALUES
+    (?, ?, 1, ?)
+ON CONFLICT (sessao_id, tipo) DO UPDATE SET
+    quantidade = quantidade + 1,
+    total = total + excluded.total
+'''
+
+SQL_ATUALIZAR_SALDO_SESSAO = '''
+UPDATE sessoes_caixa SET 
+    total_entradas = total_entradas + ?,
+    total_saidas = total_saidas + ?,
+    saldo_atual = saldo_atual + ? - ?,
+    ultima_atualizacao = ?
+WHERE id = ?
+'''
+
+def _recalcular_totais_caixa(cursor):
+    """Recalcula os totais de todas as sessões a partir dos movimentos"""
+    cursor.execute("DELETE FROM totais_sessao_caixa")
+    cursor.execute('''
+    INSERT INTO totais_sessao_caixa (sessao_id, tipo, quantidade, total)
+    SELECT sessao_id, tipo, COUNT(*), SUM(valor)
+    FROM movimentos_caixa
+    WHERE sessao_id IS NOT NULL AND tipo NOT IN (?, ?)
+    GROUP BY sessao_id, tipo
+    ''', TIPOS_CONTROLE_CAIXA)
     
-    try:
-        # Inserir movimento
-        cursor.execute('''
-        INSERT INTO movimentos_caixa 
-        (data, tipo, descricao, valor)
-        VALUES (?, ?, ?, ?)
-        ''', (
-            datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            tipo,
-            descricao,
-            valor
-        ))
-        
-        movimento_id = cursor.lastrowid
+    cursor.execute('''
+    UPDATE sessoes_caixa SET 
+        total_entradas = COALESCE((
+            SELECT SUM(total) FROM totais_sessao_caixa t
+            WHERE t.sessao_id = sessoes_caixa.id AND t.tipo IN (?, ?)
+        ), 0),
+        total_saidas = COALESCE((
+            SELECT SUM(total) FROM totais_sessao_caixa t
+            WHERE t.sessao_id = sessoes_caixa.id AND t.tipo NOT IN (?, ?)
+        ), 0)
+    ''', TIPOS_ENTRADA_CAIXA + TIPOS_ENTRADA_CAIXA)
+    cursor.execute("UPDATE sessoes_caixa SET saldo_atual = saldo_inicial + total_entradas - total_saidas")
+
+def _registrar_movimento(cursor, tipo, descricao, valor, terminal=TERMINAL_PADRAO, data=None):
+    """Insere um movimento e atualiza os totais da sessão aberta do terminal
+    
+    Deve ser chamado dentro de uma transação (de preferência imediata).
+    Movimentos com o caixa fechado são gravados sem sessão, apenas para registro.
+    """
+    data = data or datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    
+    cursor.execute("SELECT id FROM sessoes_caixa WHERE terminal = ? AND status = 'aberto'", (terminal,))
+    sessao = cursor.fetchone()
+    sessao_id = sessao[0] if sessao else None
+    
+    cursor.execute(SQL_INSERIR_MOVIMENTO_CAIXA, (data, tipo, descricao, valor, sessao_id))
+    movimento_id = cursor.lastrowid
+    
+    if sessao_id is not None and tipo not in TIPOS_CONTROLE_CAIXA:
+        cursor.execute(SQL_ACUMULAR_TOTAL_SESSAO, (sessao_id, tipo, valor))
         
-        # Atualizar saldo do caixa
-        if tipo == "entrada":
-            cursor.execute('''
-            UPDATE caixa SET 
-                saldo_atual = saldo_atual + ?,
-                ultima_atualizacao = ?
-            ''', (valor, datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+        entrada = valor if tipo in TIPOS_ENTRADA_CAIXA else 0
+        saida = 0 if tipo in TIPOS_ENTRADA_CAIXA else valor
+        cursor.execute(SQL_ATUALIZAR_SALDO_SESSAO, (entrada, saida, entrada, saida, data, sessao_id))
+    
+    return movimento_id
+
+SQL_SOMAR_TOTAIS_SESSAO = '''
+INSERT INTO totais_sessao_caixa 
+    (sessao_id, tipo, quantidade, total)
+VALUES
+    (?, ?, ?, ?)
+ON CONFLICT (sessao_id, tipo) DO UPDATE SET
+    quantidade = quantidade + excluded.quantidade,
+    total = total + excluded.total
+'''
+
+def _registrar_movimentos(cursor, movimentos):
+    """Versão em lote de _registrar_movimento para (tipo, descricao, valor, terminal, data)
+    
+    A sessão aberta de cada terminal é consultada uma vez; os movimentos são
+    inseridos num executemany e os totais de cada sessão somados antes de gravar.
+    """
+    sessoes = {}  # terminal -> id da sessão aberta
+    linhas = []
+    totais = {}   # (sessao_id, tipo) -> [quantidade, total]
+    saldos = {}   # sessao_id -> [entradas, saídas, data do último movimento]
+    
+    for tipo, descricao, valor, terminal, data in movimentos:
+        if terminal not in sessoes:
+            cursor.execute("SELECT id FROM sessoes_caixa WHERE terminal = ? AND status = 'aberto'", (terminal,))
+            sessao = cursor.fetchone()
+            sessoes[terminal] = sessao[0] if sessao else None
+        sessao_id = sessoes[terminal]
+        linhas.append((data, tipo, descricao, valor, sessao_id))
+        
+        if sessao_id is not None and tipo not in TIPOS_CONTROLE_CAIXA:
+            total = totais.setdefault((sessao_id, tipo), [0, 0])
+            total[0] += 1
+            total[1] += valor
+            saldo = saldos.setdefault(sessao_id, [0, 0, data])
+            saldo[0 if tipo in TIPOS_ENTRADA_CAIXA else 1] += valor
+            saldo[2] = max(saldo[2], data)
+    
+    cursor.executemany(SQL_INSERIR_MOVIMENTO_CAIXA, linhas)
+    cursor.executemany(SQL_SOMAR_TOTAIS_SESSAO, [
+        (sessao_id, tipo, quantidade, total) for (sessao_id, tipo), (quantidade, total) in totais.items()
+    ])
+    cursor.executemany(SQL_ATUALIZAR_SALDO_SESSAO, [
+        (entradas, saidas, entradas, saidas, data, sessao_id) for sessao_id, (entradas, saidas, data) in saldos.items()
+    ])
+
+@_instrumentada
+def get_caixa(terminal=TERMINAL_PADRAO):
+    """Retorna os dados do caixa atual
+    
+    O status e os saldos vêm da sessão mais recente do terminal, sem
+    percorrer o histórico de movimentos.
+    """
+    get_esquema()
+    
+    with conexao() as conn:
+        cursor = conn.cursor()
+    
+        cursor.execute(SQL_SESSAO_ATUAL, (terminal,))
+        result = cursor.fetchone()
+    
+        # Se ainda não houve sessão, o caixa está fechado e zerado
+        if not result:
+            return {
+                'id': None,
+                'terminal': terminal,
+                'status': 'fechado',
+                'saldo_inicial': 0,
+                'total_entradas': 0,
+                'total_saidas': 0,
+                'saldo_atual': 0,
+                'ultima_atualizacao': None,
+                'movimentacoes': []
+            }
+    
+        caixa = dict(result)
+    
+        # Buscar movimentações da sessão
+        cursor.execute('''
+        SELECT * FROM movimentos_caixa
+        WHERE sessao_id = ?
+        ORDER BY id DESC LIMIT 100
+        ''', (caixa["id"],))
+        caixa["movimentacoes"] = [dict(mov) for mov in cursor.fetchall()]
+    
+        return caixa
+
+@_instrumentada
+def get_sessoes_caixa(terminal=None, limite=50):
+    """Retorna as sessões de caixa mais recentes (para auditoria)"""
+    get_esquema()
+    
+    with conexao() as conn:
+        if terminal:
+            cursor = conn.execute(
+                "SELECT * FROM sessoes_caixa WHERE terminal = ? ORDER BY id DESC LIMIT ?",
+                (terminal, limite)
+            )
         else:
-            cursor.execute('''
-            UPDATE caixa SET 
-                saldo_atual = saldo_atual - ?,
-                ultima_atualizacao = ?
-            ''', (valor, datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+            cursor = conn.execute("SELECT * FROM sessoes_caixa ORDER BY id DESC LIMIT ?", (limite,))
+        
+        return [dict(row) for row in cursor.fetchall()]
+
+@_instrumentada
+def get_movimentos_caixa(sessao_id=None):
+    """Retorna as movimentações do caixa (de todas as sessões ou de uma sessão)"""
+    try:
+        with conexao() as conn:
+            cursor = conn.cursor()
+            
+            if sessao_id is None:
+                cursor.execute("SELECT * FROM movimentos_caixa ORDER BY data DESC")
+            else:
+                cursor.execute(
+                    "SELECT * FROM movimentos_caixa WHERE sessao_id = ? ORDER BY id DESC",
+                    (sessao_id,)
+                )
+            movimentos = [dict(row) for row in cursor.fetchall()]
+            return movimentos
+    except sqlite3.OperationalError as e:
+        print(f"Erro ao buscar movimentos do caixa: {str(e)}")
+        return []
+
+@_instrumentada
+def registrar_movimento_caixa(tipo, descricao, valor, terminal=TERMINAL_PADRAO):
+    """Registra um movimento no caixa (entrada ou saída)"""
+    try:
+        get_esquema()
         
-        conn.commit()
-        return movimento_id
+        with conexao(imediata=True) as conn:
+            return _registrar_movimento(conn.cursor(), tipo, descricao, valor, terminal)
     except Exception as e:
-        conn.rollback()
         print(f"Erro ao registrar movimento de caixa: {str(e)}")
         raise e
-    finally:
-        conn.close()
 
-def abrir_caixa(valor_inicial):
-    """Abre o caixa com um valor inicial"""
-    conn = get_connection()
-    cursor = conn.cursor()
+def _encerrar_sessao(cursor, sessao, operador, valor_final, data):
+    """Marca a sessão como fechada e registra o movimento de fechamento"""
+    descricao = f"Fechamento de caixa - Operador: {operador}"
+    cursor.execute(SQL_INSERIR_MOVIMENTO_CAIXA, (data, "fechamento", descricao, valor_final, sessao["id"]))
+    
+    cursor.execute('''
+    UPDATE sessoes_caixa SET 
+        status = 'fechado',
+        valor_final = ?,
+        diferenca = ? - saldo_atual,
+        operador_fechamento = ?,
+        fechado_em = ?,
+        ultima_atualizacao = ?
+    WHERE id = ?
+    ''', (valor_final, valor_final, operador, data, data, sessao["id"]))
+
+@_instrumentada
+def abrir_caixa(valor_inicial, terminal=TERMINAL_PADRAO, operador=None):
+    """Abre uma nova sessão de caixa com um valor inicial
+    
+    Se o terminal já tiver uma sessão aberta, ela é fechada antes; o
+    histórico das sessões anteriores é mantido. Retorna False, sem abrir,
+    se as vendas da fila não forem gravadas em ESPERA_FILA_VENDAS segundos.
+    """
+    get_esquema()
+    
+    # Vendas ainda na fila pertencem à sessão atual
+    if not aguardar_fila_vendas(ESPERA_FILA_VENDAS):
+        print(f"Erro ao abrir caixa: {MENSAGEM_FILA_VENDAS_OCUPADA}")
+        return False
     
     # Obter data/hora atual no formato correto
     data_atual = get_datetime_now()
     
-    # Verificar se já existe caixa
-    cursor.execute("SELECT * FROM caixa")
-    caixa_existente = cursor.fetchone()
+    with conexao(imediata=True) as conn:
+        cursor = conn.cursor()
+    
+        cursor.execute(SQL_SESSAO_ABERTA, (terminal,))
+        sessao_aberta = cursor.fetchone()
+        if sessao_aberta:
+            _encerrar_sessao(cursor, sessao_aberta, "sistema", sessao_aberta["saldo_atual"], data_atual)
     
-    if caixa_existente:
-        # Atualizar caixa existente
-        cursor.execute('''
-        UPDATE caixa SET 
-            saldo_inicial = ?,
-            saldo_atual = ?,
-            ultima_atualizacao = ?
-        WHERE id = ?
-        ''', (valor_inicial, valor_inicial, data_atual, caixa_existente['id']))
-    else:
-        # Criar novo caixa
         cursor.execute('''
-        INSERT INTO caixa 
-        (saldo_inicial, saldo_atual, ultima_atualizacao)
-        VALUES (?, ?, ?)
-        ''', (valor_inicial, valor_inicial, data_atual))
+        INSERT INTO sessoes_caixa 
+            (terminal, status, saldo_inicial, saldo_atual, operador_abertura, aberto_em, ultima_atualizacao)
+        VALUES
+            (?, 'aberto', ?, ?, ?, ?, ?)
+        ''', (terminal, valor_inicial, valor_inicial, operador, data_atual, data_atual))
+        sessao_id = cursor.lastrowid
     
-    # Limpar movimentações anteriores e registrar a abertura
-    cursor.execute("DELETE FROM movimentos_caixa")
+        # Registrar movimento explícito de abertura
+        cursor.execute(SQL_INSERIR_MOVIMENTO_CAIXA, (
+            data_atual,
+            "abertura",
+            "Abertura de caixa",
+            valor_inicial,
+            sessao_id
+        ))
     
-    # Registrar movimento explícito de abertura
-    cursor.execute('''
-    INSERT INTO movimentos_caixa 
-    (data, tipo, descricao, valor)
-    VALUES (?, ?, ?, ?)
-    ''', (
-        data_atual,
-        "entrada",
-        "Abertura de caixa",
-        valor_inicial
-    ))
-    
-    conn.commit()
-    conn.close()
-
-    return True
+        return True
 
-def fechar_caixa(usuario=None, valor_final=None):
-    """Fecha o caixa atual e registra o valor final"""
-    conn = get_connection()
-    cursor = conn.cursor()
+@_instrumentada
+def fechar_caixa(usuario=None, valor_final=None, terminal=TERMINAL_PADRAO):
+    """Fecha o caixa atual e registra o valor final
+    
+    Returns:
+        Para usuario "sistema" (ou None), o resumo do fechamento (dict); se
+        não houver caixa aberto, o resumo vem com sessao_id None e totais
+        zerados. Para os demais usuários, (True, mensagem) ou, sem caixa
+        aberto, (False, mensagem). Em caso de erro, (False, mensagem).
+    """
+    # Se usuario não foi fornecido, usar um padrão
+    if usuario is None:
+        usuario = "sistema"
     
     try:
-        # Buscar dados do caixa atual
-        cursor.execute('SELECT * FROM caixa WHERE id = 1')
-        caixa = dict(cursor.fetchone())
-        
-        # Se valor_final não foi fornecido, usar o saldo atual
-        if valor_final is None:
-            valor_final = caixa["saldo_atual"]
-            
-        # Se usuario não foi fornecido, usar um padrão
-        if usuario is None:
-            usuario = "sistema"
+        get_esquema()
         
-        # Registrar movimento de fechamento
-        diferenca = valor_final - caixa["saldo_atual"]
-        descricao = f"Fechamento de caixa - Operador: {usuario}"
-        data_atual = get_datetime_now()
+        # Vendas ainda na fila entram nos totais desta sessão
+        if not aguardar_fila_vendas(ESPERA_FILA_VENDAS):
+            return False, MENSAGEM_FILA_VENDAS_OCUPADA
         
-        # Registrar o fechamento do caixa
-        cursor.execute('''
-        INSERT INTO movimentos_caixa (data, tipo, descricao, valor)
-        VALUES (?, ?, ?, ?)
-        ''', (
-            data_atual,
-            "fechamento",
-            descricao,
-            valor_final
-        ))
-        
-        # Salvar saldo atual para retornar um resumo
-        saldo_inicial = caixa["saldo_inicial"]
-        saldo_final = caixa["saldo_atual"]
+        with conexao(imediata=True) as conn:
+            cursor = conn.cursor()
+            
+            # Buscar a sessão aberta do terminal
+            cursor.execute(SQL_SESSAO_ABERTA, (terminal,))
+            sessao = cursor.fetchone()
+            if not sessao:
+                if usuario != "sistema":
+                    return False, "Não há caixa aberto para fechar"
+                # O fechamento pelo sistema sempre devolveu um resumo
+                return {
+                    'sessao_id': None,
+                    'terminal': terminal,
+                    'data_fechamento': get_datetime_now(),
+                    'saldo_inicial': 0,
+                    'total_entradas': 0,
+                    'total_saidas': 0,
+                    'saldo_final': 0,
+                    'valor_final': valor_final if valor_final is not None else 0,
+                    'diferenca': valor_final if valor_final is not None else 0,
+                    'totais_por_tipo': {}
+                }
+            
+            # Se valor_final não foi fornecido, usar o saldo atual
+            if valor_final is None:
+                valor_final = sessao["saldo_atual"]
+            
+            data_atual = get_datetime_now()
+            _encerrar_sessao(cursor, sessao, usuario, valor_final, data_atual)
+            
+            # Totais já acumulados durante a sessão
+            cursor.execute(
+                "SELECT tipo, quantidade, total FROM totais_sessao_caixa WHERE sessao_id = ?",
+                (sessao["id"],)
+            )
+            totais_por_tipo = {row["tipo"]: row["total"] for row in cursor.fetchall()}
+            
+            # Preparar resumo para retornar
+            resumo = {
+                'sessao_id': sessao["id"],
+                'terminal': terminal,
+                'data_fechamento': data_atual,
+                'saldo_inicial': sessao["saldo_inicial"],
+                'total_entradas': sessao["total_entradas"],
+                'total_saidas': sessao["total_saidas"],
+                'saldo_final': sessao["saldo_atual"],
+                'valor_final': valor_final,
+                'diferenca': valor_final - sessao["saldo_atual"],
+                'totais_por_tipo': totais_por_tipo
+            }
+            
+            return resumo if usuario == "sistema" else (True, "Caixa fechado com sucesso")
+    except Exception as e:
+        print(f"Erro ao fechar caixa: {str(e)}")
+        return False, f"Erro ao fechar caixa: {str(e)}"
+
+# Fila de gravação de vendas (opcional). Com a fila ativa, enfileirar_venda()
+# escreve a venda num diário em arquivo e retorna; uma thread junta as vendas
+# pendentes e grava várias na mesma transação, com o movimento de caixa de
+# cada uma. Consultas feitas logo depois podem ainda não ver as últimas
+# vendas; abrir e fechar o caixa esperam a fila esvaziar (e desistem depois
+# de ESPERA_FILA_VENDAS segundos). Se o aplicativo cair, as vendas do
+# diário que não chegaram ao banco são gravadas na próxima ativação.
+# Cada processo ativa a fila com o próprio terminal, que identifica o
+# diário e o controle do que dele já foi gravado.
+
+# Diário das vendas pendentes, trava do diário e vendas rejeitadas de cada
+# terminal, no diretório do banco
+ARQUIVO_FILA_VENDAS = 'vendas_pendentes_{}.jsonl'
+ARQUIVO_TRAVA_FILA_VENDAS = 'vendas_pendentes_{}.lock'
+ARQUIVO_VENDAS_REJEITADAS = 'vendas_rejeitadas_{}.jsonl'
+
+# Diário da fila de antes da separação por terminal (do terminal padrão)
+ARQUIVO_FILA_VENDAS_ANTIGO = 'vendas_pendentes.jsonl'
+
+# Máximo de vendas por transação e espera máxima para juntar um lote
+TAMANHO_LOTE_FILA_VENDAS = 50
+INTERVALO_FILA_VENDAS_MS = 50
+
+# Com False o diário sobrevive a uma queda do aplicativo, mas não a uma
+# queda de energia (mesma garantia do banco com synchronous=NORMAL);
+# True faz fsync a cada venda enfileirada.
+SINCRONIZAR_FILA_VENDAS = False
+
+# Com o banco ocupado a fila tenta de novo indefinidamente (a venda já está
+# no diário), esperando 0,5 s, 1 s, 2 s... até este máximo entre tentativas
+ESPERA_MAXIMA_NOVA_TENTATIVA_FILA = 5
+
+# Espera máxima das operações de caixa pela fila
+ESPERA_FILA_VENDAS = 30
+MENSAGEM_FILA_VENDAS_OCUPADA = "Ainda há vendas da fila sendo gravadas; tente novamente em instantes"
+
+def _banco_ocupado(erro):
+    """True se o erro é de banco ocupado/travado e vale a pena tentar de novo"""
+    codigo = getattr(erro, 'sqlite_errorcode', None)
+    return codigo is not None and codigo & 0xff in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED)
+
+def _nome_arquivo_terminal(terminal):
+    """Parte do nome dos arquivos da fila que identifica o terminal"""
+    nome = re.sub(r'[^\w-]', '_', terminal)
+    if nome != terminal:
+        # Evita que 'caixa 1' e 'caixa_1' dividam o mesmo diário
+        nome += '_' + hashlib.md5(terminal.encode('utf-8')).hexdigest()[:8]
+    return nome
+
+def _travar_arquivo(f):
+    """Trava o arquivo aberto para este processo; False se outro processo já o travou"""
+    try:
+        if os.name == 'nt':
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        return False
+    return True
+
+def _movimento_venda(dados, terminal):
+    """Movimento de caixa de uma venda normalizada, no formato de _registrar_movimentos"""
+    return ("venda", f"Venda {dados['codigo']}", dados["valor_total"], terminal, dados["data_venda"])
+
+def _gravar_vendas_com_caixa(cursor, registros):
+    """Grava registros da fila ({'venda', 'terminal', 'caixa'}) e retorna os IDs das vendas"""
+    ids = _gravar_vendas(cursor, [registro["venda"] for registro in registros])
+    _registrar_movimentos(cursor, [
+        _movimento_venda(registro["venda"], registro["terminal"]) for registro in registros if registro["caixa"]
+    ])
+    return ids
+
+class VendaPendente:
+    """Venda entregue à fila; aguardar() retorna o ID quando ela estiver no banco"""
+
+    def __init__(self, sequencia, dados):
+        self.sequencia = sequencia
+        self.codigo = dados["codigo"]
+        self.venda_id = None
+        self.erro = None
+        self._concluida = threading.Event()
+
+    def _concluir(self, venda_id=None, erro=None):
+        self.venda_id = venda_id
+        self.erro = erro
+        self._concluida.set()
+
+    @property
+    def concluida(self):
+        return self._concluida.is_set()
+
+    def aguardar(self, timeout=None):
+        """Espera a gravação e retorna o ID da venda (None se o tempo acabar)
         
-        # Buscar movimentos do dia para o resumo
-        cursor.execute('''
-        SELECT tipo, SUM(valor) as total 
-        FROM movimentos_caixa 
-        WHERE data >= ? AND tipo != 'fechamento'
-        GROUP BY tipo
-        ''', (caixa["ultima_atualizacao"],))
-        
-        movimentos = cursor.fetchall()
-        total_entradas = 0
-        total_saidas = 0
-        
-        for mov in movimentos:
-            if mov['tipo'].lower() in ['entrada', 'venda']:
-                total_entradas += mov['total']
-            else:
-                total_saidas += mov['total']
+        Se a venda foi rejeitada, levanta o erro que impediu a gravação.
+        """
+        if not self._concluida.wait(timeout):
+            return None
+        if self.erro is not None:
+            raise self.erro
+        return self.venda_id
+
+
+class FilaVendas:
+    """Diário em arquivo das vendas pendentes e a thread que as grava em lotes"""
+
+    def __init__(self, diretorio, terminal, tamanho_lote, intervalo):
+        nome = _nome_arquivo_terminal(terminal)
+        self.terminal = terminal
+        self.diretorio = diretorio
+        self.caminho = os.path.join(diretorio, ARQUIVO_FILA_VENDAS.format(nome))
+        self.caminho_trava = os.path.join(diretorio, ARQUIVO_TRAVA_FILA_VENDAS.format(nome))
+        self.caminho_rejeitadas = os.path.join(diretorio, ARQUIVO_VENDAS_REJEITADAS.format(nome))
+        self.tamanho_lote = tamanho_lote
+        self.intervalo = intervalo
+        self._condicao = threading.Condition()
+        self._pendentes = collections.deque()  # (VendaPendente, registro do diário)
+        self._gravando = 0
+        self._tentativas = 0  # falhas seguidas por banco ocupado
+        self._aguardando = 0
+        self._parar = False
+        self._sequencia = 0
+        self._diario = None
+        self._trava = None
+        self._thread = None
+
+    def iniciar(self):
+        """Recupera as vendas do diário ainda não gravadas e inicia a thread; retorna quantas foram recuperadas"""
+        self._trava = open(self.caminho_trava, 'a')
+        if not _travar_arquivo(self._trava):
+            self._trava.close()
+            raise RuntimeError(f"A fila de vendas do terminal {self.terminal} já está ativa em outro processo")
+        try:
+            return self._recuperar_e_iniciar()
+        except BaseException:
+            self._trava.close()
+            raise
+
+    def _recuperar_e_iniciar(self):
+        with conexao() as conn:
+            conn.execute("INSERT OR IGNORE INTO fila_vendas (terminal, ultima_sequencia) VALUES (?, 0)", (self.terminal,))
+            aplicada = conn.execute(
+                "SELECT ultima_sequencia FROM fila_vendas WHERE terminal = ?", (self.terminal,)
+            ).fetchone()[0]
+        self._sequencia = aplicada
+        
+        antigo = os.path.join(self.diretorio, ARQUIVO_FILA_VENDAS_ANTIGO)
+        if self.terminal == TERMINAL_PADRAO and os.path.exists(antigo) and not os.path.exists(self.caminho):
+            os.replace(antigo, self.caminho)
+        
+        if os.path.exists(self.caminho):
+            with open(self.caminho, encoding='utf-8') as f:
+                for texto in f:
+                    try:
+                        registro = json.loads(texto)
+                    except ValueError:
+                        # Linha incompleta de uma queda durante a escrita
+                        continue
+                    self._sequencia = max(self._sequencia, registro["sequencia"])
+                    if registro["sequencia"] > aplicada:
+                        self._pendentes.append((VendaPendente(registro["sequencia"], registro["venda"]), registro))
+        
+        # Reescreve o diário só com as pendentes (descarta linhas incompletas)
+        temporario = self.caminho + ".tmp"
+        with open(temporario, 'w', encoding='utf-8') as f:
+            for _, registro in self._pendentes:
+                f.write(json.dumps(registro, ensure_ascii=False) + "\n")
+        os.replace(temporario, self.caminho)
+        
+        self._diario = open(self.caminho, 'a', encoding='utf-8')
+        self._thread = threading.Thread(target=self._executar, name="fila-vendas", daemon=True)
+        self._thread.start()
+        return len(self._pendentes)
+
+    def enfileirar(self, dados, terminal, registrar_caixa):
+        """Escreve a venda no diário e a entrega à thread de gravação"""
+        with self._condicao:
+            if self._parar:
+                raise RuntimeError("A fila de vendas foi desativada")
+            registro = {
+                "sequencia": self._sequencia + 1,
+                "venda": dados,
+                "terminal": terminal,
+                "caixa": registrar_caixa
+            }
+            self._diario.write(json.dumps(registro, ensure_ascii=False) + "\n")
+            self._diario.flush()
+            if SINCRONIZAR_FILA_VENDAS:
+                os.fsync(self._diario.fileno())
+            self._sequencia += 1
+            
+            pendente = VendaPendente(self._sequencia, dados)
+            self._pendentes.append((pendente, registro))
+            self._condicao.notify_all()
+        return pendente
+
+    def aguardar(self, timeout=None):
+        """Espera até todas as vendas enfileiradas estarem gravadas; False se o tempo acabar"""
+        limite = None if timeout is None else time.monotonic() + timeout
+        with self._condicao:
+            # Quem aguarda não precisa esperar o lote encher
+            self._aguardando += 1
+            self._condicao.notify_all()
+            try:
+                while self._pendentes or self._gravando:
+                    restante = None if limite is None else limite - time.monotonic()
+                    if restante is not None and restante <= 0:
+                        return False
+                    self._condicao.wait(restante)
+                return True
+            finally:
+                self._aguardando -= 1
+
+    def parar(self, timeout=None):
+        """Grava o que estiver pendente e encerra a thread; False se sobrou venda no diário"""
+        gravadas = self.aguardar(timeout)
+        with self._condicao:
+            self._parar = True
+            self._condicao.notify_all()
+        self._thread.join(timeout)
+        if not self._thread.is_alive():
+            self._diario.close()
+            self._trava.close()
+        return gravadas
+
+    def _executar(self):
+        while True:
+            with self._condicao:
+                while not self._pendentes and not self._parar:
+                    self._condicao.wait()
+                if not self._pendentes:
+                    return
+                
+                # Espera um pouco por mais vendas para gravá-las no mesmo commit
+                limite = time.monotonic() + self.intervalo
+                while len(self._pendentes) < self.tamanho_lote and not self._parar and not self._aguardando:
+                    restante = limite - time.monotonic()
+                    if restante <= 0:
+                        break
+                    self._condicao.wait(restante)
+                
+                lote = [self._pendentes.popleft() for _ in range(min(self.tamanho_lote, len(self._pendentes)))]
+                self._gravando = len(lote)
+            
+            devolvidas = self._gravar(lote)
+            
+            with self._condicao:
+                # Banco ocupado: voltam para o início da fila, na ordem original
+                self._pendentes.extendleft(reversed(devolvidas))
+                self._gravando = 0
+                if not self._pendentes:
+                    # Tudo o que estava no diário já está no banco
+                    self._diario.truncate(0)
+                self._condicao.notify_all()
+            if devolvidas:
+                time.sleep(min(0.5 * 2 ** min(self._tentativas - 1, 10), ESPERA_MAXIMA_NOVA_TENTATIVA_FILA))
+
+    def _gravar_lote(self, lote):
+        with conexao(imediata=True) as conn:
+            cursor = conn.cursor()
+            ids = _gravar_vendas_com_caixa(cursor, [registro for _, registro in lote])
+            cursor.execute(
+                "UPDATE fila_vendas SET ultima_sequencia = MAX(ultima_sequencia, ?) WHERE terminal = ?",
+                (lote[-1][1]["sequencia"], self.terminal)
+            )
+        return ids
+
+    def _gravar(self, lote):
+        """Grava o lote e retorna as entradas que devem ser tentadas de novo"""
+        try:
+            ids = self._gravar_lote(lote)
+        except Exception as e:
+            if _banco_ocupado(e):
+                # Não é problema da venda: nunca rejeitar, só esperar
+                self._tentativas += 1
+                print(f"Erro ao gravar vendas da fila, nova tentativa em instantes: {str(e)}")
+                return lote
+            if len(lote) > 1:
+                # Grava uma a uma para separar a venda com problema das demais.
+                # Se uma delas tiver de esperar, as seguintes esperam junto:
+                # gravá-las avançaria ultima_sequencia por cima da que ficou.
+                for i, entrada in enumerate(lote):
+                    if self._gravar([entrada]):
+                        return lote[i:]
+                return []
+            self._tentativas = 0
+            self._rejeitar(lote[0], e)
+            return []
         
-        # Atualizar caixa - zerando completamente o saldo
-        cursor.execute('''
-        UPDATE caixa SET 
-            saldo_inicial = 0,
-            saldo_atual = 0,
-            ultima_atualizacao = ?
-        WHERE id = 1
-        ''', (data_atual,))
-        
-        conn.commit()
-        
-        # Preparar resumo para retornar
-        resumo = {
-            'data_fechamento': data_atual,
-            'saldo_inicial': saldo_inicial,
-            'total_entradas': total_entradas,
-            'total_saidas': total_saidas,
-            'saldo_final': saldo_final
-        }
+        self._tentativas = 0
+        for (pendente, _), venda_id in zip(lote, ids):
+            pendente._concluir(venda_id)
+        return []
+
+    def _rejeitar(self, entrada, erro):
+        """Guarda a venda que não pôde ser gravada e a marca como tratada"""
+        pendente, registro = entrada
+        print(f"Erro ao gravar a venda {pendente.codigo} da fila: {str(erro)}")
+        try:
+            with open(self.caminho_rejeitadas, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(dict(registro, erro=str(erro)), ensure_ascii=False) + "\n")
+            with conexao() as conn:
+                conn.execute(
+                    "UPDATE fila_vendas SET ultima_sequencia = MAX(ultima_sequencia, ?) WHERE terminal = ?",
+                    (registro["sequencia"], self.terminal)
+                )
+        except (OSError, sqlite3.Error) as e:
+            print(f"Erro ao registrar venda rejeitada: {str(e)}")
+        pendente._concluir(erro=erro)
+
+
+_fila_vendas = None
+_lock_fila_vendas = threading.Lock()
+
+def ativar_fila_vendas(tamanho_lote=TAMANHO_LOTE_FILA_VENDAS, intervalo_ms=INTERVALO_FILA_VENDAS_MS,
+                       terminal=TERMINAL_PADRAO):
+    """Liga a gravação em segundo plano das vendas feitas por enfileirar_venda()
+    
+    O diário é o do terminal informado (o do caixa deste processo); só um
+    processo por vez pode ativar a fila de um mesmo terminal. Vendas que
+    ficaram no diário numa execução anterior são gravadas logo em seguida.
+    
+    Returns:
+        int: Quantidade de vendas recuperadas do diário
+    
+    Raises:
+        RuntimeError: Se a fila do terminal já estiver ativa em outro processo
+    """
+    global _fila_vendas
+    with _lock_fila_vendas:
+        if _fila_vendas is not None:
+            return 0
+        get_esquema()
+        fila = FilaVendas(get_app_data_dir(), terminal, tamanho_lote, intervalo_ms / 1000)
+        recuperadas = fila.iniciar()
+        _fila_vendas = fila
+        return recuperadas
+
+def desativar_fila_vendas(timeout=None):
+    """Grava as vendas pendentes e desliga a fila
+    
+    Returns:
+        bool: False se o tempo acabou com vendas ainda no diário (serão
+        gravadas na próxima ativação)
+    """
+    global _fila_vendas
+    with _lock_fila_vendas:
+        fila, _fila_vendas = _fila_vendas, None
+    if fila is None:
+        return True
+    return fila.parar(timeout)
+
+atexit.register(desativar_fila_vendas)
+
+def aguardar_fila_vendas(timeout=None):
+    """Espera até todas as vendas enfileiradas estarem no banco; False se o tempo acabar"""
+    fila = _fila_vendas
+    return fila.aguardar(timeout) if fila is not None else True
+
+@_instrumentada
+def enfileirar_venda(venda, valor_total=None, forma_pagamento=None, desconto=0, valor_recebido=0, troco=0,
+                     terminal=TERMINAL_PADRAO, registrar_caixa=True):
+    """Registra a venda e, se registrar_caixa, o movimento 'venda' no caixa do terminal
+    
+    Com a fila ativa, retorna assim que a venda estiver no diário; use
+    aguardar() no retorno ou aguardar_fila_vendas() quando precisar da
+    confirmação. Sem a fila, grava na hora, numa única transação.
+    
+    Returns:
+        VendaPendente: venda_id já preenchido se a gravação foi imediata
+    """
+    dados = _normalizar_venda(venda, valor_total, forma_pagamento, desconto)
+    
+    fila = _fila_vendas
+    if fila is not None:
+        return fila.enfileirar(dados, terminal, registrar_caixa)
+    
+    pendente = VendaPendente(None, dados)
+    try:
+        get_esquema()
         
-        return resumo if usuario == "sistema" else (True, "Caixa fechado com sucesso")
+        with conexao(imediata=True) as conn:
+            registro = {"venda": dados, "terminal": terminal, "caixa": registrar_caixa}
+            venda_id = _gravar_vendas_com_caixa(conn.cursor(), [registro])[0]
     except Exception as e:
-        conn.rollback()
-        print(f"Erro ao fechar caixa: {str(e)}")
-        return False, f"Erro ao fechar caixa: {str(e)}"
-    finally:
-        conn.close()
+        print(f"Erro ao registrar venda: {str(e)}")
+        raise e
+    
+    pendente._concluir(venda_id)
+    return pendente
 
 def get_usuarios():
     """Retorna a lista de usuários"""
-    conn = get_connection()
-    cursor = conn.cursor()
+    with conexao() as conn:
+        cursor = conn.cursor()
     
-    cursor.execute("SELECT * FROM usuarios")
-    usuarios = [dict(user) for user in cursor.fetchall()]
+        cursor.execute("SELECT * FROM usuarios")
+        usuarios = [dict(user) for user in cursor.fetchall()]
     
-    conn.close()
-    return usuarios
+        return usuarios
 
 def verificar_login(usuario, senha):
     """Verifica as credenciais de login"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    
-    try:
+    with conexao() as conn:
+        cursor = conn.cursor()
+        
         # Verificar se o usuário existe
         cursor.execute("SELECT * FROM usuarios WHERE usuario = ?", (usuario,))
         user = cursor.fetchone()
-        
+    
         if not user:
             # Usuário não encontrado
             return None
-        
+    
         # Verificar a senha (comparando com a senha em texto plano para o admin)
         if user['usuario'] == 'admin' and senha == 'admin':
             return dict(user)
-        
+    
         # Para outros usuários, verificar a senha hash
         senha_hash = hash_password(senha)
         if user['senha'] == senha_hash:
             return dict(user)
-        
+    
         return None
-    finally:
-        conn.close()
 
 def cadastrar_usuario(nome, usuario, senha, tipo="vendedor"):
     """Cadastra um novo usuário"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    
-    # Verificar se o usuário já existe
-    cursor.execute("SELECT * FROM usuarios WHERE usuario = ?", (usuario,))
-    if cursor.fetchone():
-        conn.close()
-        return False, "Nome de usuário já existe. Por favor escolha outro."
+    with conexao() as conn:
+        cursor = conn.cursor()
     
-    # Verificar se o nome de usuário tem formato válido
-    if not usuario.isalnum():
-        conn.close()
-        return False, "Nome de usuário deve conter apenas letras e números."
+        # Verificar se o usuário já existe
+        cursor.execute("SELECT * FROM usuarios WHERE usuario = ?", (usuario,))
+        if cursor.fetchone():
+            return False, "Nome de usuário já existe. Por favor escolha outro."
     
-    if len(usuario) < 3:
-        conn.close()
-        return False, "Nome de usuário deve ter pelo menos 3 caracteres."
+        # Verificar se o nome de usuário tem formato válido
+        if not usuario.isalnum():
+            return False, "Nome de usuário deve conter apenas letras e números."
     
-    # Verificar requisitos de senha
-    if len(senha) < 4:
-        conn.close()
-        return False, "Senha deve ter pelo menos 4 caracteres."
+        if len(usuario) < 3:
+            return False, "Nome de usuário deve ter pelo menos 3 caracteres."
     
-    senha_hash = hash_password(senha)
+        # Verificar requisitos de senha
+        if len(senha) < 4:
+            return False, "Senha deve ter pelo menos 4 caracteres."
     
-    # Inserir usuário
-    cursor.execute('''
-    INSERT INTO usuarios 
-    (nome, usuario, senha, tipo)
-    VALUES (?, ?, ?, ?)
-    ''', (nome, usuario, senha_hash, tipo))
+        senha_hash = hash_password(senha)
     
-    conn.commit()
-    conn.close()
+        # Inserir usuário
+        cursor.execute('''
+        INSERT INTO usuarios 
+        (nome, usuario, senha, tipo)
+        VALUES (?, ?, ?, ?)
+        ''', (nome, usuario, senha_hash, tipo))
     
-    return True, "Usuário cadastrado com sucesso"
+        return True, "Usuário cadastrado com sucesso"
 
+@_instrumentada
 def atualizar_estoque(codigo_produto, quantidade_delta):
     """Atualiza o estoque de um produto pelo código
     
@@ -1238,115 +3152,210 @@ def atualizar_estoque(codigo_produto, quantidade_delta):
     Returns:
         bool: True se o produto foi encontrado e atualizado, False caso contrário
     """
-    conn = get_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-    UPDATE produtos SET quantidade = CASE 
-        WHEN quantidade + ? < 0 THEN 0 
-        ELSE quantidade + ? 
-    END
-    WHERE codigo = ?
-    ''', (quantidade_delta, quantidade_delta, codigo_produto))
-    
-    if cursor.rowcount > 0:
-        conn.commit()
-        conn.close()
-        return True
-    
-    conn.close()
-    return False 
+    with conexao() as conn:
+        cursor = conn.execute('''
+        UPDATE produtos SET quantidade = CASE 
+            WHEN quantidade + ? < 0 THEN 0 
+            ELSE quantidade + ? 
+        END
+        WHERE codigo = ?
+        ''', (quantidade_delta, quantidade_delta, codigo_produto))
+        _invalidar_catalogo_apos_commit(codigos=[codigo_produto])
+        
+        return cursor.rowcount > 0
 
+@_instrumentada
 def get_itens_venda(venda_id):
     """Retorna os itens de uma venda específica"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    
     try:
-        cursor.execute('''
-        SELECT * FROM itens_venda WHERE venda_id = ?
-        ''', (venda_id,))
+        with conexao() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute('''
+            SELECT * FROM itens_venda WHERE venda_id = ?
+            ''', (venda_id,))
         
-        itens = [dict(item) for item in cursor.fetchall()]
-        return itens
+            itens = [dict(item) for item in cursor.fetchall()]
+            return itens
     except Exception as e:
         print(f"Erro ao buscar itens da venda {venda_id}: {str(e)}")
         return []
-    finally:
-        conn.close()
 
+def _periodo_em_dias(data_inicio=None, data_fim=None):
+    """Converte o período em dias inteiros para consulta aos resumos diários
+    
+    Returns:
+        tuple: (dia_inicial, dia_final), ou None se o período começa ou
+        termina no meio de um dia e precisa ser calculado pelas vendas
+    """
+    inicio, fim = _periodo(data_inicio, data_fim)
+    if inicio[10:] not in ('', ' 00:00:00') or fim[10:] != ' 23:59:59':
+        return None
+    return inicio[:10], fim[:10]
+
+@_instrumentada
 def get_produtos_mais_vendidos(data_inicio=None, data_fim=None):
     """Retorna os produtos mais vendidos em um determinado período"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    
-    # Verificar se a coluna data_venda existe
-    cursor.execute("PRAGMA table_info(vendas)")
-    colunas = cursor.fetchall()
-    tem_data_venda = any(coluna[1] == 'data_venda' for coluna in colunas)
-    coluna_data = 'data_venda' if tem_data_venda else 'data'
-    
     try:
-        # Verificar se a tabela itens_venda existe
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='itens_venda'")
-        if not cursor.fetchone():
-            print("Tabela itens_venda não encontrada")
-            return []
+        get_esquema()
+        
+        with conexao() as conn:
+            cursor = conn.cursor()
             
-        # Verificar se a tabela vendas existe
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='vendas'")
-        if not cursor.fetchone():
-            print("Tabela vendas não encontrada")
-            return []
+            dias = _periodo_em_dias(data_inicio, data_fim)
             
-        query = """
-        SELECT 
-            iv.produto_id,
-            p.nome,
-            p.categoria,
-            SUM(iv.quantidade) as quantidade_total,
-            SUM(iv.subtotal) as valor_total
-        FROM 
-            itens_venda iv
-        JOIN 
-            vendas v ON iv.venda_id = v.id
-        LEFT JOIN
-            produtos p ON iv.produto_id = p.id
-        """
-        
-        params = []
-        where_clause = []
-        
-        if data_inicio:
-            where_clause.append(f"v.{coluna_data} >= ?")
-            params.append(data_inicio)
-        
-        if data_fim:
-            where_clause.append(f"v.{coluna_data} <= ?")
-            # Garantir que inclua todo o último dia
-            if not ' ' in data_fim:
-                data_fim = data_fim + " 23:59:59"
-            params.append(data_fim)
-        
-        if where_clause:
-            query += " WHERE " + " AND ".join(where_clause)
-        
-        query += """
-        GROUP BY 
-            iv.produto_id
-        ORDER BY 
-            valor_total DESC
-        """
-        
-        cursor.execute(query, params)
-        produtos = [dict(row) for row in cursor.fetchall()]
-        
-        return produtos
+            if not (data_inicio or data_fim) or dias:
+                # Leitura pelo resumo diário: o custo depende do número de
+                # dias e produtos, não do número de vendas
+                query = """
+                SELECT 
+                    r.produto_id,
+                    p.nome,
+                    p.categoria,
+                    SUM(r.quantidade) as quantidade_total,
+                    SUM(r.valor_total) as valor_total
+                FROM 
+                    resumo_produtos_dia r
+                LEFT JOIN
+                    produtos p ON r.produto_id = p.id
+                """
+                params = ()
+                
+                if dias:
+                    query += " WHERE r.dia >= ? AND r.dia <= ?"
+                    params = dias
+                
+                query += """
+                GROUP BY 
+                    r.produto_id
+                ORDER BY 
+                    valor_total DESC
+                """
+            else:
+                # Período com horário: somar os itens das vendas do intervalo
+                query = """
+                SELECT 
+                    iv.produto_id,
+                    p.nome,
+                    p.categoria,
+                    SUM(iv.quantidade) as quantidade_total,
+                    SUM(iv.subtotal) as valor_total
+                FROM 
+                    vendas v
+                JOIN 
+                    itens_venda iv ON iv.venda_id = v.id
+                LEFT JOIN
+                    produtos p ON iv.produto_id = p.id
+                WHERE 
+                    v.data_venda >= ? AND v.data_venda <= ?
+                GROUP BY 
+                    iv.produto_id
+                ORDER BY 
+                    valor_total DESC
+                """
+                params = _periodo(data_inicio, data_fim)
+            
+            cursor.execute(query, params)
+            produtos = [dict(row) for row in cursor.fetchall()]
+            
+            return produtos
     except Exception as e:
         print(f"Erro ao buscar produtos mais vendidos: {str(e)}")
         return []
-    finally:
-        conn.close()
+
+@_instrumentada
+def get_resumo_vendas(data_inicio=None, data_fim=None):
+    """Retorna os totais de vendas do período, gerais e por forma de pagamento
+    
+    Returns:
+        dict: quantidade_vendas, valor_total, desconto_total, ticket_medio e
+        formas_pagamento (lista com os mesmos totais por forma de pagamento)
+    """
+    get_esquema()
+    
+    with conexao() as conn:
+        cursor = conn.cursor()
+        
+        dias = _periodo_em_dias(data_inicio, data_fim)
+        
+        if not (data_inicio or data_fim) or dias:
+            query = """
+            SELECT 
+                forma_pagamento,
+                SUM(quantidade_vendas) as quantidade_vendas,
+                SUM(valor_total) as valor_total,
+                SUM(desconto_total) as desconto_total
+            FROM resumo_vendas_dia
+            """
+            params = ()
+            
+            if dias:
+                query += " WHERE dia >= ? AND dia <= ?"
+                params = dias
+        else:
+            query = """
+            SELECT 
+                COALESCE(forma_pagamento, '') as forma_pagamento,
+                COUNT(*) as quantidade_vendas,
+                COALESCE(SUM(valor_total), 0) as valor_total,
+                COALESCE(SUM(desconto), 0) as desconto_total
+            FROM vendas
+            WHERE data_venda >= ? AND data_venda <= ?
+            """
+            params = _periodo(data_inicio, data_fim)
+        
+        query += " GROUP BY 1 ORDER BY valor_total DESC"
+        cursor.execute(query, params)
+        formas_pagamento = [dict(row) for row in cursor.fetchall()]
+    
+    quantidade_vendas = sum(forma["quantidade_vendas"] for forma in formas_pagamento)
+    valor_total = sum(forma["valor_total"] for forma in formas_pagamento)
+    
+    return {
+        'quantidade_vendas': quantidade_vendas,
+        'valor_total': valor_total,
+        'desconto_total': sum(forma["desconto_total"] for forma in formas_pagamento),
+        'ticket_medio': valor_total / quantidade_vendas if quantidade_vendas else 0,
+        'formas_pagamento': formas_pagamento
+    }
+
+@_instrumentada
+def get_vendas_por_dia(data_inicio=None, data_fim=None):
+    """Retorna a quantidade e o valor das vendas de cada dia do período
+    
+    Os limites do período são considerados em dias inteiros.
+    """
+    get_esquema()
+    
+    inicio, fim = _periodo(data_inicio, data_fim)
+    
+    with conexao() as conn:
+        cursor = conn.execute('''
+        SELECT 
+            dia,
+            SUM(quantidade_vendas) as quantidade_vendas,
+            SUM(valor_total) as valor_total
+        FROM resumo_vendas_dia
+        WHERE dia >= ? AND dia <= ?
+        GROUP BY dia
+        ORDER BY dia
+        ''', (inicio[:10], fim[:10]))
+        
+        return [dict(row) for row in cursor.fetchall()]
+
+# Imagens dos produtos. Os originais são guardados pelo hash do conteúdo
+# (<sha256><ext>), então a mesma foto usada por várias variações ocupa um
+# único arquivo. A miniatura de cada imagem é gerada uma vez, em segundo
+# plano, e servida de um cache em memória com limite de tamanho.
+
+# Lado (em pixels) das miniaturas quadradas usadas na grade de produtos
+TAMANHO_MINIATURA = 256
+
+# Memória máxima ocupada pelas miniaturas em cache
+LIMITE_CACHE_MINIATURAS = 32 * 1024 * 1024
+
+# Extensões reconhecidas ao processar uma pasta de fotos
+EXTENSOES_IMAGEM = ('.jpg', '.jpeg', '.png', '.webp', '.gif', '.bmp')
 
 def get_images_dir():
     """Retorna o diretório de imagens da aplicação"""
@@ -1357,9 +3366,151 @@ def get_images_dir():
     os.makedirs(images_dir, exist_ok=True)
     return images_dir
 
+def get_thumbnails_dir():
+    """Retorna o diretório das miniaturas das imagens"""
+    thumbnails_dir = os.path.join(get_images_dir(), 'miniaturas')
+    os.makedirs(thumbnails_dir, exist_ok=True)
+    return thumbnails_dir
+
+class CacheMiniaturas:
+    """Conteúdo das miniaturas mais usadas, limitado a limite_bytes (sai a menos usada)"""
+
+    def __init__(self, limite_bytes):
+        self.limite_bytes = limite_bytes
+        self._itens = collections.OrderedDict()
+        self._tamanho = 0
+        self._lock = threading.Lock()
+
+    def obter(self, chave):
+        with self._lock:
+            dados = self._itens.get(chave)
+            if dados is not None:
+                self._itens.move_to_end(chave)
+            return dados
+
+    def guardar(self, chave, dados):
+        if len(dados) > self.limite_bytes:
+            return
+        with self._lock:
+            anterior = self._itens.pop(chave, None)
+            if anterior is not None:
+                self._tamanho -= len(anterior)
+            self._itens[chave] = dados
+            self._tamanho += len(dados)
+            while self._tamanho > self.limite_bytes:
+                _, removido = self._itens.popitem(last=False)
+                self._tamanho -= len(removido)
+
+    def limpar(self):
+        with self._lock:
+            self._itens.clear()
+            self._tamanho = 0
+
+
+_cache_miniaturas = CacheMiniaturas(LIMITE_CACHE_MINIATURAS)
+_executor_imagens = None
+_miniaturas_em_andamento = {}  # caminho da miniatura -> Future
+_lock_imagens = threading.Lock()
+
+def _executor():
+    """Pool de threads das imagens (o Pillow libera o GIL ao decodificar e redimensionar)"""
+    global _executor_imagens
+    with _lock_imagens:
+        if _executor_imagens is None:
+            _executor_imagens = ThreadPoolExecutor(
+                max_workers=min(4, os.cpu_count() or 1),
+                thread_name_prefix="imagens"
+            )
+        return _executor_imagens
+
+def _armazenar_imagem(original_path):
+    """Copia a imagem para o diretório de imagens com o hash do conteúdo como nome
+    
+    Returns:
+        tuple: (nome do arquivo, True se o conteúdo ainda não existia)
+    """
+    images_dir = get_images_dir()
+    _, ext = os.path.splitext(original_path)
+    
+    # Lê uma única vez: calcula o hash enquanto copia para um temporário
+    resumo = hashlib.sha256()
+    descritor, temporario = tempfile.mkstemp(dir=images_dir, suffix='.tmp')
+    try:
+        with os.fdopen(descritor, 'wb') as destino, open(original_path, 'rb') as origem:
+            for bloco in iter(lambda: origem.read(1024 * 1024), b''):
+                resumo.update(bloco)
+                destino.write(bloco)
+        
+        image_filename = f"{resumo.hexdigest()}{ext.lower()}"
+        dest_path = os.path.join(images_dir, image_filename)
+        if os.path.exists(dest_path):
+            return image_filename, False
+        os.replace(temporario, dest_path)
+        return image_filename, True
+    finally:
+        if os.path.exists(temporario):
+            os.remove(temporario)
+
+def _caminho_miniatura(image_filename):
+    nome, _ = os.path.splitext(os.path.basename(image_filename))
+    return os.path.join(get_thumbnails_dir(), f"{nome}_{TAMANHO_MINIATURA}.jpg")
+
+def _gerar_miniatura(original, destino):
+    """Gera a miniatura quadrada (fundo branco) se ela ainda não existir"""
+    if os.path.exists(destino):
+        return destino
+    
+    with Image.open(original) as imagem:
+        # Em JPEG decodifica já reduzida, sem passar pela resolução cheia
+        imagem.draft('RGB', (TAMANHO_MINIATURA * 2, TAMANHO_MINIATURA * 2))
+        imagem = ImageOps.exif_transpose(imagem)
+        imagem.thumbnail((TAMANHO_MINIATURA, TAMANHO_MINIATURA))
+        
+        miniatura = Image.new('RGB', (TAMANHO_MINIATURA, TAMANHO_MINIATURA), (255, 255, 255))
+        if imagem.mode in ('RGBA', 'LA', 'P'):
+            imagem = imagem.convert('RGBA')
+            mascara = imagem.getchannel('A')
+        else:
+            imagem = imagem.convert('RGB')
+            mascara = None
+        miniatura.paste(imagem, (
+            (TAMANHO_MINIATURA - imagem.width) // 2,
+            (TAMANHO_MINIATURA - imagem.height) // 2
+        ), mascara)
+    
+    descritor, temporario = tempfile.mkstemp(dir=os.path.dirname(destino), suffix='.tmp')
+    try:
+        with os.fdopen(descritor, 'wb') as f:
+            miniatura.save(f, 'JPEG', quality=85, optimize=True)
+        os.replace(temporario, destino)
+    finally:
+        if os.path.exists(temporario):
+            os.remove(temporario)
+    return destino
+
+def _agendar_miniatura(image_filename):
+    """Gera a miniatura no pool de threads; retorna o Future (ou None sem Pillow)"""
+    if Image is None:
+        return None
+    
+    destino = _caminho_miniatura(image_filename)
+    original = get_product_image_path(image_filename)
+    executor = _executor()
+    with _lock_imagens:
+        futuro = _miniaturas_em_andamento.get(destino)
+        if futuro is None:
+            futuro = executor.submit(_gerar_miniatura, original, destino)
+            _miniaturas_em_andamento[destino] = futuro
+    futuro.add_done_callback(lambda _: _miniaturas_em_andamento.pop(destino, None))
+    return futuro
+
 def save_product_image(original_path, product_code):
     """Salva a imagem do produto no diretório apropriado
     
+    A imagem é guardada pelo hash do conteúdo, então fotos iguais de
+    produtos diferentes viram um único arquivo. A miniatura é gerada em
+    segundo plano.
+    
     Args:
         original_path: Caminho da imagem original
         product_code: Código do produto
@@ -1369,22 +3520,11 @@ def save_product_image(original_path, product_code):
     """
     if not original_path or not os.path.exists(original_path):
         return ""
-        
-    # Obter diretório de imagens
-    images_dir = get_images_dir()
-    
-    # Criar nome do arquivo baseado no código do produto
-    _, ext = os.path.splitext(original_path)
-    image_filename = f"{product_code}{ext}"
-    
-    # Caminho completo para o arquivo de destino
-    dest_path = os.path.join(images_dir, image_filename)
     
     try:
-        # Copiar a imagem para o diretório de destino
-        import shutil
-        shutil.copy2(original_path, dest_path)
-        print(f"Imagem copiada com sucesso para: {dest_path}")
+        image_filename, _ = _armazenar_imagem(original_path)
+        _agendar_miniatura(image_filename)
+        print(f"Imagem do produto {product_code} salva como: {image_filename}")
         return image_filename
     except Exception as e:
         print(f"Erro ao copiar imagem: {str(e)}")
@@ -1405,86 +3545,205 @@ def get_product_image_path(image_filename):
     images_dir = get_images_dir()
     return os.path.join(images_dir, image_filename)
 
+def get_product_thumbnail_path(image_filename):
+    """Retorna o caminho da miniatura da imagem, gerando-a se ainda não existir
+    
+    Imagens salvas antes das miniaturas ganham a sua no primeiro acesso.
+    Sem o Pillow instalado, retorna o caminho da imagem original.
+    
+    Args:
+        image_filename: Nome do arquivo da imagem
+        
+    Returns:
+        str: Caminho da miniatura ("" se a imagem não existir)
+    """
+    if not image_filename:
+        return ""
+    
+    original = get_product_image_path(image_filename)
+    if Image is None:
+        return original if os.path.exists(original) else ""
+    
+    destino = _caminho_miniatura(image_filename)
+    if os.path.exists(destino):
+        return destino
+    if not os.path.exists(original):
+        return ""
+    
+    try:
+        return _agendar_miniatura(image_filename).result()
+    except Exception as e:
+        print(f"Erro ao gerar miniatura de {image_filename}: {str(e)}")
+        return original
+
+def get_product_thumbnail(image_filename):
+    """Retorna o conteúdo (JPEG) da miniatura, usando o cache em memória
+    
+    Args:
+        image_filename: Nome do arquivo da imagem
+        
+    Returns:
+        bytes: Conteúdo da miniatura, ou None se a imagem não existir
+    """
+    if not image_filename:
+        return None
+    
+    dados = _cache_miniaturas.obter(image_filename)
+    if dados is None:
+        caminho = get_product_thumbnail_path(image_filename)
+        if not caminho:
+            return None
+        with open(caminho, 'rb') as f:
+            dados = f.read()
+        _cache_miniaturas.guardar(image_filename, dados)
+    return dados
+
+def _processar_imagem(caminho):
+    """Armazena uma imagem e gera sua miniatura (executado no pool)"""
+    image_filename, nova = _armazenar_imagem(caminho)
+    if Image is not None:
+        try:
+            _gerar_miniatura(caminho, _caminho_miniatura(image_filename))
+        except Exception:
+            # Arquivo que não é imagem válida não fica no diretório
+            if nova:
+                os.remove(get_product_image_path(image_filename))
+            raise
+    return image_filename, nova
+
+@_instrumentada
+def import_product_images(folder, atualizar_produtos=True, progresso=None):
+    """Processa todas as fotos de uma pasta (sem subpastas) no pool de threads
+    
+    Cada foto é armazenada pelo hash do conteúdo e tem a miniatura gerada.
+    Com atualizar_produtos, a foto cujo nome (sem extensão) é o código de
+    um produto passa a ser a imagem dele.
+    
+    progresso, se informado, é chamado a cada foto com
+    (fotos_processadas, total_de_fotos, quantidade_de_erros).
+    
+    Returns:
+        dict: 'processadas', 'novas' (arquivos que não existiam), 'produtos_atualizados',
+        'imagens' ({caminho da foto: nome armazenado}) e 'erros' ([(caminho, mensagem)])
+    """
+    caminhos = sorted(
+        entrada.path for entrada in os.scandir(folder)
+        if entrada.is_file() and os.path.splitext(entrada.name)[1].lower() in EXTENSOES_IMAGEM
+    )
+    resultado = {'processadas': 0, 'novas': 0, 'produtos_atualizados': 0, 'imagens': {}, 'erros': []}
+    
+    futuros = {_executor().submit(_processar_imagem, caminho): caminho for caminho in caminhos}
+    for futuro in as_completed(futuros):
+        caminho = futuros[futuro]
+        try:
+            image_filename, nova = futuro.result()
+            resultado['imagens'][caminho] = image_filename
+            resultado['novas'] += nova
+        except Exception as e:
+            resultado['erros'].append((caminho, str(e)))
+        resultado['processadas'] += 1
+        if progresso:
+            progresso(resultado['processadas'], len(caminhos), len(resultado['erros']))
+    
+    if atualizar_produtos and resultado['imagens']:
+        associacoes = [
+            (image_filename, os.path.splitext(os.path.basename(caminho))[0])
+            for caminho, image_filename in resultado['imagens'].items()
+        ]
+        with conexao() as conn:
+            # rowcount soma só as linhas do UPDATE (total_changes incluiria as dos gatilhos)
+            cursor = conn.executemany('''
+            UPDATE produtos SET imagem = ?, updated_at = CURRENT_TIMESTAMP
+            WHERE codigo = ?
+            ''', associacoes)
+            resultado['produtos_atualizados'] = cursor.rowcount
+            _invalidar_catalogo_apos_commit(codigos=[codigo for _, codigo in associacoes])
+    
+    return resultado
+
 def limpar_todos_produtos():
     """Remove todos os produtos do banco de dados"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    
     try:
-        # Verificar se existem itens_venda referenciando produtos
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='itens_venda'")
-        if cursor.fetchone():
-            # Remover referências na tabela itens_venda primeiro
-            cursor.execute("DELETE FROM itens_venda")
+        with conexao() as conn:
+            cursor = conn.cursor()
+            
+            # Verificar se existem itens_venda referenciando produtos
+            if 'itens_venda' in get_esquema()["tabelas"]:
+                # Remover referências na tabela itens_venda primeiro
+                cursor.execute("DELETE FROM itens_venda")
+                cursor.execute("DELETE FROM resumo_produtos_dia")
         
-        # Apagar todos os produtos
-        cursor.execute("DELETE FROM produtos")
+            # Apagar todos os produtos
+            cursor.execute("DELETE FROM produtos")
+            _invalidar_catalogo_apos_commit()
         
-        conn.commit()
-        return True, "Todos os produtos foram removidos com sucesso!"
+            return True, "Todos os produtos foram removidos com sucesso!"
     except Exception as e:
-        conn.rollback()
         print(f"Erro ao remover produtos: {str(e)}")
         return False, f"Erro ao remover produtos: {str(e)}"
-    finally:
-        conn.close() 
 
 def limpar_todas_vendas():
     """Remove todos os registros de vendas do banco de dados"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    
     try:
-        # Verificar se a tabela itens_venda existe e limpar
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='itens_venda'")
-        if cursor.fetchone():
-            cursor.execute("DELETE FROM itens_venda")
+        if not aguardar_fila_vendas(ESPERA_FILA_VENDAS):
+            return False, MENSAGEM_FILA_VENDAS_OCUPADA
         
-        # Limpar tabela de vendas
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='vendas'")
-        if cursor.fetchone():
-            cursor.execute("DELETE FROM vendas")
+        with conexao() as conn:
+            cursor = conn.cursor()
             
-        # Limpar movimentos de caixa relacionados a vendas
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='movimentos_caixa'")
-        if cursor.fetchone():
-            cursor.execute("DELETE FROM movimentos_caixa WHERE tipo = 'entrada' AND descricao LIKE '%Venda%'")
+            tabelas = get_esquema()["tabelas"]
+            
+            # Verificar se a tabela itens_venda existe e limpar
+            if 'itens_venda' in tabelas:
+                cursor.execute("DELETE FROM itens_venda")
         
-        conn.commit()
-        return True, "Todos os registros de vendas foram removidos com sucesso!"
+            # Limpar tabela de vendas
+            if 'vendas' in tabelas:
+                cursor.execute("DELETE FROM vendas")
+            
+            # Limpar resumos diários
+            cursor.execute("DELETE FROM resumo_vendas_dia")
+            cursor.execute("DELETE FROM resumo_produtos_dia")
+            
+            # Limpar movimentos de caixa relacionados a vendas
+            if 'movimentos_caixa' in tabelas:
+                # 'venda' é o tipo gravado por enfileirar_venda; 'entrada' com "Venda" no texto, o registro manual
+                cursor.execute(
+                    "DELETE FROM movimentos_caixa WHERE tipo = 'venda' OR (tipo = 'entrada' AND descricao LIKE '%Venda%')"
+                )
+                _recalcular_totais_caixa(cursor)
+        
+            return True, "Todos os registros de vendas foram removidos com sucesso!"
     except Exception as e:
-        conn.rollback()
         print(f"Erro ao remover vendas: {str(e)}")
         return False, f"Erro ao remover vendas: {str(e)}"
-    finally:
-        conn.close()
 
 def limpar_fluxo_caixa():
     """Remove todos os registros de movimento de caixa e reinicia o saldo"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    
     try:
-        # Verificar se a tabela movimentos_caixa existe e limpar completamente
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='movimentos_caixa'")
-        if cursor.fetchone():
-            cursor.execute("DELETE FROM movimentos_caixa")
-        
-        # Verificar se a tabela caixa existe e reiniciar o saldo para zero
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='caixa'")
-        if cursor.fetchone():
-            cursor.execute("""
-                UPDATE caixa SET 
-                saldo_inicial = 0,
-                saldo_atual = 0,
-                ultima_atualizacao = ?
-            """, (datetime.now().strftime("%Y-%m-%d %H:%M:%S"),))
-        
-        conn.commit()
-        return True, "Fluxo de caixa limpo com sucesso!"
+        with conexao() as conn:
+            cursor = conn.cursor()
+            
+            tabelas = get_esquema()["tabelas"]
+            
+            # Verificar se a tabela movimentos_caixa existe e limpar completamente
+            if 'movimentos_caixa' in tabelas:
+                cursor.execute("DELETE FROM movimentos_caixa")
+            
+            # Remover também as sessões de caixa e seus totais
+            cursor.execute("DELETE FROM totais_sessao_caixa")
+            cursor.execute("DELETE FROM sessoes_caixa")
+        
+            # Verificar se a tabela caixa existe e reiniciar o saldo para zero
+            if 'caixa' in tabelas:
+                cursor.execute("""
+                    UPDATE caixa SET 
+                    saldo_inicial = 0,
+                    saldo_atual = 0,
+                    ultima_atualizacao = ?
+                """, (datetime.now().strftime("%Y-%m-%d %H:%M:%S"),))
+        
+            return True, "Fluxo de caixa limpo com sucesso!"
     except Exception as e:
-        conn.rollback()
         print(f"Erro ao limpar fluxo de caixa: {str(e)}")
         return False, f"Erro ao limpar fluxo de caixa: {str(e)}"
-    finally:
-        conn.close() 
\ No newline at end of file